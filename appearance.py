@@ -0,0 +1,356 @@
+"""
+Appearance streams for filled DDAH form fields.
+
+Setting a field's /V alone leaves every viewer and print server to lay the
+value out itself, which is slow and which some of them skip. For every
+text field and dropdown that is filled, AppearanceBuilder builds the /AP
+stream a viewer would: the value in the field's /DA font and size, aligned
+as /Q says, wrapped if the field is multiline.
+
+The glyph widths of the /DR fonts and the layout of every field (size,
+font, alignment) are worked out once per template; the streams themselves
+are cached by field and value, so a value that many TAs share (such as a
+category name or the course code) is built once and shared by all forms.
+
+flatten() turns the fields of a filled form into static page content.
+"""
+import os
+import re
+
+from pdfrw import PdfArray, PdfDict, PdfName, PdfObject
+
+from field_map import load_field_map
+from template_cache import load_template
+
+# Annotation Key used by pdfrw
+ANNOT_KEY = '/Annots'
+
+# Field flags (PDF 1.7, section 12.7.4)
+MULTILINE = 1 << 12
+
+# Annotation flags (PDF 1.7, section 12.5.3)
+HIDDEN = 1 << 1
+
+# Space between a field's border and its text, in points
+PADDING = 2
+
+# Width of glyphs missing from a font's /Widths, in 1/1000 em
+DEFAULT_WIDTH = 500
+
+# Line spacing of multiline fields, relative to the font size
+LEADING = 1.15
+
+# At most this many appearance streams are kept for reuse
+MAX_CACHED_STREAMS = 10000
+
+# AppearanceBuilders, keyed by (absolute template path, modification time)
+_CACHE = {}
+
+_FONT_OPERATOR = re.compile(r"/(\S+)\s+([\d.]+)\s+Tf")
+
+
+def _number(x):
+    return "{0:.2f}".format(x)
+
+
+def _inherited(annot, key):
+    """
+    Return the value of key on the widget annot or on its closest parent
+    field that has it.
+    """
+    while annot is not None:
+        if annot[key] is not None:
+            return annot[key]
+        annot = annot.Parent
+    return None
+
+
+def _pdf_text(text):
+    """
+    Encode text as a literal string for a WinAnsiEncoding font.
+    """
+    text = text.encode("cp1252", "replace").decode("latin-1")
+    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return "(" + text + ")"
+
+
+class FontMetrics(object):
+    """
+    The glyph widths and vertical extent of a simple font.
+    """
+
+    def __init__(self, font):
+        self.first_char = int(font.FirstChar or 0)
+        self.widths = [float(width) for width in font.Widths or []]
+        descriptor = font.FontDescriptor
+        if descriptor is not None:
+            self.ascent = float(descriptor.Ascent)
+            self.descent = float(descriptor.Descent)
+        else:
+            # Helvetica, the usual font without metrics in the file
+            self.ascent = 718.0
+            self.descent = -207.0
+
+    def width(self, text, size):
+        """
+        Return the width of text (a cp1252 encodable string) at size.
+        """
+        total = 0.0
+        count = len(self.widths)
+        for char in text.encode("cp1252", "replace"):
+            code = char - self.first_char
+            total += self.widths[code] if 0 <= code < count else DEFAULT_WIDTH
+        return total * size / 1000.0
+
+
+class FieldLayout(object):
+    """
+    Everything about one widget that does not depend on its value.
+    """
+
+    def __init__(self, annot, acroform, metrics):
+        rect = [float(x) for x in annot.Rect]
+        self.width = abs(rect[2] - rect[0])
+        self.height = abs(rect[3] - rect[1])
+
+        da = _inherited(annot, "/DA") or acroform.DA
+        self.da = da.to_unicode() if da is not None else "/Helv 0 Tf 0 g"
+        match = _FONT_OPERATOR.search(self.da)
+        if match is None:
+            raise ValueError("Unsupported field appearance {0}".format(
+                self.da))
+        self.font_name = match.group(1)
+        self.font = acroform.DR.Font[PdfName(self.font_name)]
+        if self.font is None:
+            raise ValueError("Template has no font {0}".format(
+                self.font_name))
+        self.metrics = metrics(self.font_name, self.font)
+
+        self.quadding = int(_inherited(annot, "/Q") or 0)
+        self.multiline = bool(int(_inherited(annot, "/Ff") or 0) & MULTILINE)
+
+        self.size = float(match.group(2))
+        if self.size == 0:
+            # Auto size: as large as fits the height of the field
+            extent = (self.metrics.ascent - self.metrics.descent) / 1000.0
+            self.size = min(12.0, (self.height - 2 * PADDING) / extent)
+            self.da = _FONT_OPERATOR.sub(
+                "/{0} {1} Tf".format(self.font_name, _number(self.size)),
+                self.da)
+
+        # Dropdowns show the display text of the selected export value
+        self.choices = {}
+        for option in _inherited(annot, "/Opt") or []:
+            if isinstance(option, PdfArray):
+                self.choices[option[0].to_unicode()] = option[1].to_unicode()
+
+    def lines(self, text):
+        """
+        Break text into the lines shown in the field.
+        """
+        if not self.multiline:
+            return [" ".join(text.splitlines())]
+        room = self.width - 2 * PADDING
+        lines = []
+        for paragraph in text.splitlines() or [""]:
+            line = ""
+            for word in paragraph.split(" "):
+                candidate = word if not line else line + " " + word
+                if line and self.metrics.width(candidate, self.size) > room:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return lines
+
+    def content(self, value):
+        """
+        Return the content stream showing value in this field.
+        """
+        text = self.choices.get(value, value)
+        size = self.size
+        metrics = self.metrics
+        leading = size * LEADING
+        lines = self.lines(text)
+
+        if self.multiline:
+            y = self.height - PADDING - metrics.ascent * size / 1000.0
+        else:
+            extent = (metrics.ascent - metrics.descent) * size / 1000.0
+            y = (self.height - extent) / 2 - metrics.descent * size / 1000.0
+
+        ops = ["/Tx BMC", "q",
+               "{0} {1} {2} {3} re W n".format(
+                   1, 1, _number(self.width - 2), _number(self.height - 2)),
+               "BT", self.da]
+        previous_x = 0.0
+        for number, line in enumerate(lines):
+            line_width = metrics.width(line, size)
+            if self.quadding == 1:
+                x = (self.width - line_width) / 2
+            elif self.quadding == 2:
+                x = self.width - PADDING - line_width
+            else:
+                x = PADDING
+            if number == 0:
+                ops.append("{0} {1} Td".format(_number(x), _number(y)))
+            else:
+                ops.append("{0} {1} Td".format(_number(x - previous_x),
+                                               _number(-leading)))
+            ops.append(_pdf_text(line) + " Tj")
+            previous_x = x
+        ops.extend(["ET", "Q", "EMC"])
+        return "\n".join(ops)
+
+    def appearance(self, value):
+        """
+        Return a form XObject showing value in this field.
+        """
+        fonts = PdfDict()
+        fonts[PdfName(self.font_name)] = self.font
+        stream = PdfDict(Type=PdfName.XObject,
+                         Subtype=PdfName.Form,
+                         BBox=PdfArray([0, 0, PdfObject(_number(self.width)),
+                                        PdfObject(_number(self.height))]),
+                         Resources=PdfDict(Font=fonts))
+        stream.stream = self.content(value)
+        return stream
+
+
+class AppearanceBuilder(object):
+    """
+    Builds /AP streams for the logical fields of a template (see
+    field_map.py).
+    """
+
+    def __init__(self, template_pdf, field_map):
+        self._metrics = {}
+        self._streams = {}
+        acroform = template_pdf.Root.AcroForm
+        self.layouts = {}
+        for name, location in field_map.items():
+            page, index = location[:2]
+            annot = template_pdf.pages[page][ANNOT_KEY][index]
+            self.layouts[name] = FieldLayout(annot, acroform, self.metrics)
+
+    def metrics(self, font_name, font):
+        """
+        Return the FontMetrics of the /DR font font_name.
+        """
+        metrics = self._metrics.get(font_name)
+        if metrics is None:
+            metrics = self._metrics[font_name] = FontMetrics(font)
+        return metrics
+
+    def stream(self, name, value):
+        """
+        Return the normal appearance of logical field name set to value
+        (a string).
+        """
+        key = (name, value)
+        stream = self._streams.get(key)
+        if stream is None:
+            if len(self._streams) >= MAX_CACHED_STREAMS:
+                self._streams.clear()
+            stream = self._streams[key] = self.layouts[name].appearance(value)
+        return stream
+
+
+def load_appearances(template="DDAH.pdf"):
+    """
+    Return the AppearanceBuilder of template, creating it the first time
+    it is requested (or after the template changes on disk).
+    """
+    path = os.path.abspath(template)
+    key = (path, os.path.getmtime(path))
+    builder = _CACHE.get(key)
+    if builder is None:
+        builder = _CACHE[key] = AppearanceBuilder(
+            load_template(template).template, load_field_map(template))
+    return builder
+
+
+def _normal_appearance(annot):
+    """
+    Return the /N appearance stream of a widget annotation, or None.
+    """
+    if annot.AP is None or annot.AP.N is None:
+        return None
+    appearance = annot.AP.N
+    if appearance.stream is None:
+        # Check boxes and radio buttons: one appearance per state
+        if annot.AS is None:
+            return None
+        appearance = appearance[annot.AS]
+    return appearance
+
+
+def _appearance_box(appearance):
+    """
+    Return the (x0, y0, x1, y1) box that an appearance stream covers: its
+    /BBox transformed by its /Matrix, as in PDF 1.7, section 12.5.5.
+    """
+    x1, y1, x2, y2 = [float(x) for x in appearance.BBox]
+    if appearance.Matrix is None:
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+    a, b, c, d, e, f = [float(x) for x in appearance.Matrix]
+    xs = []
+    ys = []
+    for x, y in ((x1, y1), (x1, y2), (x2, y1), (x2, y2)):
+        xs.append(a * x + c * y + e)
+        ys.append(b * x + d * y + f)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def flatten(template_pdf):
+    """
+    Draw the appearance of every visible field of template_pdf (a filled
+    TemplateCache clone) onto its page and drop the form, so that the
+    values become ordinary page content.
+    """
+    for page in template_pdf.pages:
+        annots = page[ANNOT_KEY]
+        if annots is None:
+            continue
+        if page.Resources.XObject is None:
+            page.Resources.XObject = PdfDict()
+        xobjects = page.Resources.XObject
+
+        kept = PdfArray()
+        ops = []
+        for number, annot in enumerate(annots):
+            if annot.Subtype != PdfName.Widget:
+                kept.append(annot)
+                continue
+            appearance = _normal_appearance(annot)
+            if appearance is None or int(annot.F or 0) & HIDDEN:
+                continue
+            name = PdfName("Field{0}".format(number))
+            xobjects[name] = appearance
+
+            x1, y1, x2, y2 = [float(x) for x in annot.Rect]
+            # Do applies the stream's /Matrix itself; cm maps the box it
+            # covers onto the annotation rectangle
+            bx1, by1, bx2, by2 = _appearance_box(appearance)
+            sx = abs(x2 - x1) / (bx2 - bx1) if bx2 != bx1 else 1.0
+            sy = abs(y2 - y1) / (by2 - by1) if by2 != by1 else 1.0
+            ops.append("q {0} 0 0 {1} {2} {3} cm {4} Do Q".format(
+                _number(sx), _number(sy), _number(min(x1, x2) - bx1 * sx),
+                _number(min(y1, y2) - by1 * sy), name))
+
+        page.Annots = kept if kept else None
+        if ops:
+            # Wrap the original contents in q/Q so their graphics state
+            # does not leak into the fields
+            contents = page.Contents
+            if not isinstance(contents, PdfArray):
+                contents = [contents]
+            before = PdfDict()
+            before.stream = "q"
+            after = PdfDict()
+            after.stream = "Q\n" + "\n".join(ops)
+            page.Contents = PdfArray([before] + list(contents) + [after])
+
+    template_pdf.Root.AcroForm = None
+    return template_pdf
@@ -0,0 +1,144 @@
+"""
+Write generated forms straight into a ZIP or tar archive.
+
+Sample Usage:
+
+    with ArchiveWriter("forms.zip") as archive:
+        with archive.open(archive.entry_name(ta_data["name"], "CSC338")) as f:
+            PdfWriter().write(f, fill_pdf(ta_data))
+
+    ArchiveWriter("-", "tar.gz")    # a gzipped tar on stdout
+
+The archive is written as a stream: every form goes straight into its
+entry and nothing is read back or seeked, so the archive can go to stdout
+or a pipe. ZIP entries are compressed while the PDF is serialized into
+them; a tar entry needs its size up front, so each form is serialized in
+memory first (one form at a time).
+"""
+import io
+import sys
+import tarfile
+import time
+import zipfile
+
+from naming import file_name, unique_name
+
+# Archive formats, by the file extensions that select them
+FORMATS = {".zip": "zip",
+           ".tar": "tar",
+           ".tar.gz": "tar.gz",
+           ".tgz": "tar.gz"}
+
+# tarfile stream modes of the tar formats
+_TAR_MODES = {"tar": "w|", "tar.gz": "w|gz"}
+
+
+def guess_format(path):
+    """
+    Return the archive format ("zip", "tar" or "tar.gz") selected by the
+    extension of path, or None.
+    """
+    lower = path.lower()
+    for extension in sorted(FORMATS, key=len, reverse=True):
+        if lower.endswith(extension):
+            return FORMATS[extension]
+    return None
+
+
+class _TarEntry(io.BytesIO):
+    """
+    A tar member being written; added to the archive when closed.
+    """
+
+    def __init__(self, tar_file, name):
+        io.BytesIO.__init__(self)
+        self.tar_file = tar_file
+        self.name = name
+
+    def close(self):
+        if not self.closed:
+            info = tarfile.TarInfo(self.name)
+            info.size = self.tell()
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self.seek(0)
+            self.tar_file.addfile(info, self)
+        io.BytesIO.close(self)
+
+
+class ArchiveWriter(object):
+    """
+    A ZIP or tar archive of generated forms, written as a stream to a file,
+    to a binary file object, or to stdout ("-").
+    """
+
+    def __init__(self, target, format=None):
+        if format is None:
+            if isinstance(target, str) and target != "-":
+                format = guess_format(target)
+            else:
+                format = "zip"
+        if format not in _TAR_MODES and format != "zip":
+            raise ValueError("Unknown archive format {0}, expected one of "
+                             "{1}".format(format, ", ".join(
+                                 sorted(set(FORMATS.values())))))
+        self.format = format
+        # Entry names used so far, see naming.unique_name
+        self.names = {}
+        self._owned = not (target == "-" or hasattr(target, "write"))
+        if target == "-":
+            fileobj = sys.stdout.buffer
+        elif self._owned:
+            fileobj = open(target, "wb")
+        else:
+            fileobj = target
+        self.fileobj = fileobj
+        if format == "zip":
+            self.archive = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(fileobj=fileobj,
+                                        mode=_TAR_MODES[format])
+
+    def entry_name(self, name, directory=None):
+        """
+        Return a new entry name for the form of the TA called name, in
+        directory (e.g. the course code) if given: "CSC338/Jane_Doe.pdf".
+        Names already used get a number, "CSC338/Jane_Doe_2.pdf". One entry
+        per form is kept to tell, so memory grows with the number of forms.
+        """
+        prefix = file_name(directory) + "/" if directory else ""
+        return unique_name(prefix + file_name(name), self.names) + ".pdf"
+
+    def open(self, name):
+        """
+        Return a binary file object for the entry name; the entry is
+        complete once it is closed.
+        """
+        if self.format == "zip":
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            return self.archive.open(info, "w")
+        return _TarEntry(self.archive, name)
+
+    def write(self, name, data):
+        """
+        Add the entry name holding the bytes data.
+        """
+        with self.open(name) as f:
+            f.write(data)
+
+    def close(self):
+        self.archive.close()
+        if self._owned:
+            self.fileobj.close()
+        else:
+            # stdout or the caller's file: leave it open, but write out
+            # what is buffered
+            self.fileobj.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,497 @@
+"""
+Generate DDAH forms for a whole directory of TA files using several cores.
+
+Sample Usage:
+
+    python batch.py tas/
+    python batch.py -j 8 --engine overlay -o out/ "tas/*.txt"
+    python batch.py --combined all.pdf tas/
+    python batch.py --flatten -o print/ tas/
+    python batch.py --compact 9 -o archive/ tas/
+    python batch.py --incremental -o out/ tas/
+    python batch.py --archive forms.zip tas/
+    python batch.py --archive - --archive-format tar.gz tas/ > forms.tar.gz
+    python batch.py --manifest out/manifest.json -o out/ tas/
+    python batch.py --profile profile.json --profile-format chrome tas/
+    python batch.py --engine auto -o out/ tas/
+
+Each worker process parses the template once and then fills one form per
+TA file, with one of the engines of engines.py; --engine auto times them
+on a sample TA first and uses the fastest one whose forms are correct.
+A file that fails to parse (e.g. hours that do not add up) is reported in
+the summary at the end instead of stopping the run.
+
+With --combined, every TA's form is added to one PDF instead. The template
+objects all TAs share (fonts, images, page contents) are written once, so
+each extra TA only adds its pages, annotations and field values.
+
+With --flatten, the form fields are turned into static page content (acroform
+engine only), e.g. for print jobs; see appearance.py.
+
+With --compact, the PDFs are written with compressed object streams and
+deduplicated objects, and the bytes saved per form are reported; see
+compact.py.
+
+With --incremental, each PDF is the template file as it is, followed by an
+incremental update with only the filled fields; see incremental.py.
+
+With --archive, the forms go into one ZIP or tar archive (or a stream of it
+on stdout) as <course code>/<TA name>.pdf, without writing any PDF file;
+see archive.py.
+
+With --manifest, only the PDFs whose inputs changed since the last run are
+regenerated; see manifest.py.
+
+With --profile, the time and allocations of each stage (template parsing,
+filling, rendering, merging, writing) are recorded per TA, in every worker,
+and written as JSON or as a Chrome trace; see profiling.py.
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+
+from pdfrw import PdfWriter, PdfDict, PdfArray, PdfString
+
+import profiling
+from archive import ArchiveWriter, guess_format
+from compact import DEFAULT_LEVEL, write_compact
+from convert import APPROVER, DATE, INFO_FIELDS
+from engines import (PDF_ENGINES, choose_engine, format_report, get_engine,
+                     resolve_engine)
+from field_map import template_hash
+from manifest import Manifest, build_key
+from naming import check_output_paths, output_path
+from roster import find_data_files, parse_data
+
+# Engines that write the forms of a batch
+ENGINES = PDF_ENGINES
+
+# Per-process state, set up by _init_worker
+_WORKER = {}
+
+
+def _check_options(engine, flatten):
+    if engine not in ENGINES and engine != "auto":
+        raise ValueError("Unknown engine {0}, expected one of {1}".format(
+            engine, ", ".join(sorted(ENGINES) + ["auto"])))
+    if flatten and engine not in ("acroform", "auto"):
+        raise ValueError("Only the acroform engine can flatten forms")
+
+
+def _init_worker(engine, template, profile=False, flatten=False,
+                 compact=None, incremental=False):
+    """
+    Set up a worker process. If profile is true, stage events are recorded
+    here and returned with each result, for the parent to report. If
+    compact is a level, PDFs are written with write_compact; with
+    incremental, with write_incremental.
+    """
+    _WORKER["recorder"] = None
+    if profile:
+        profiling.clear_callbacks()
+        _WORKER["recorder"] = profiling.Recorder()
+        profiling.add_callback(_WORKER["recorder"])
+    _WORKER["engine"] = get_engine(engine, template, flatten, compact,
+                                   incremental)
+    # Parse the template now, once per worker. If that fails (the parent
+    # checked it, see engines.load_engine), every job reports the error:
+    # an initializer that raises makes the Pool start workers forever.
+    try:
+        _WORKER["engine"].load()
+    except Exception:
+        pass
+
+
+def _process(job):
+    """
+    Generate the form for one data file. Returns (data_file, pdf_out_file,
+    error, profile events, write_compact stats), where error is None on
+    success and the stats are None unless writing compact PDFs.
+    """
+    data_file, pdf_out_file = job
+    error = stats = None
+    with profiling.ta(data_file):
+        try:
+            with profiling.stage("parse_data"):
+                ta_data = parse_data(data_file)
+            filled_pdf = _WORKER["engine"].fill(ta_data)
+            with profiling.stage("pdf_write"):
+                stats = _WORKER["engine"].write(pdf_out_file, filled_pdf)
+        except Exception as e:
+            pdf_out_file = None
+            error = "{0}: {1}".format(type(e).__name__, e)
+    recorder = _WORKER["recorder"]
+    events = recorder.drain() if recorder is not None else []
+    return data_file, pdf_out_file, error, events, stats
+
+
+def _render(data_file):
+    """
+    Generate the form for one data file into memory. Returns (data_file,
+    TA name, PDF bytes, error, profile events, write_compact stats), where
+    the name and bytes are None if error is not.
+    """
+    name = data = error = stats = None
+    with profiling.ta(data_file):
+        try:
+            with profiling.stage("parse_data"):
+                ta_data = parse_data(data_file)
+            filled_pdf = _WORKER["engine"].fill(ta_data)
+            with profiling.stage("pdf_write"):
+                out = io.BytesIO()
+                stats = _WORKER["engine"].write(out, filled_pdf)
+            name, data = ta_data["name"], out.getvalue()
+        except Exception as e:
+            error = "{0}: {1}".format(type(e).__name__, e)
+    recorder = _WORKER["recorder"]
+    events = recorder.drain() if recorder is not None else []
+    return data_file, name, data, error, events, stats
+
+
+def run_batch(data_files, outdir=None, engine="acroform", workers=None,
+              template="DDAH.pdf", manifest=None, flatten=False,
+              compact=None, incremental=False):
+    """
+    Generate one form per file in data_files with a pool of workers
+    (default: one per core). If manifest is the path of a build manifest,
+    files whose inputs have not changed since the last run are skipped.
+    With flatten, the forms are written without fillable fields. If
+    compact is a compression level, the forms are written compactly (see
+    compact.py); with incremental, as incremental updates of the template
+    (see incremental.py).
+
+    Returns a summary dict with the list of "written" PDF paths, the list
+    of "up_to_date" PDF paths that were skipped, and the list of "failed"
+    (data_file, error message) pairs. With compact, "sizes" lists the
+    (PDF path, plain bytes, compact bytes) of every written form.
+
+    Raises ValueError, before any form is written, if two data files
+    would be written to the same PDF (see check_output_paths).
+    """
+    _check_options(engine, flatten)
+    if compact is not None and incremental:
+        raise ValueError("Forms cannot be both compact and incremental")
+    check_output_paths(data_files, outdir)
+    engine = resolve_engine(engine, template, flatten, compact, incremental)
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    # The same file given twice is only generated once
+    data_files = list(dict.fromkeys(data_files))
+    jobs = [(data_file, output_path(data_file, outdir))
+            for data_file in data_files]
+    up_to_date = []
+    keys = {}
+    if manifest is not None:
+        manifest = Manifest(manifest)
+        template_digest = template_hash(template)
+        variant = engine + "+flatten" if flatten else engine
+        if compact is not None:
+            variant += "+compact{0}".format(compact)
+        if incremental:
+            variant += "+incremental"
+        for data_file, pdf_out_file in jobs:
+            try:
+                keys[pdf_out_file] = build_key(
+                    data_file, variant, template_digest, INFO_FIELDS,
+                    APPROVER, DATE)
+            except IOError:
+                # Missing file; let the worker report it
+                continue
+        up_to_date = [pdf_out_file for data_file, pdf_out_file in jobs
+                      if manifest.is_up_to_date(pdf_out_file,
+                                                keys.get(pdf_out_file))]
+        skipped = set(up_to_date)
+        jobs = [job for job in jobs if job[1] not in skipped]
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(jobs)) or 1
+
+    if not jobs:
+        results = []
+    elif workers == 1:
+        _init_worker(engine, template, flatten=flatten, compact=compact,
+                     incremental=incremental)
+        results = [_process(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(engine, template,
+                                              profiling.enabled(), flatten,
+                                              compact, incremental))
+        try:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            results = list(pool.imap_unordered(_process, jobs, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = {"written": [], "up_to_date": up_to_date, "failed": []}
+    if compact is not None:
+        summary["sizes"] = []
+    for data_file, pdf_out_file, error, events, stats in sorted(results):
+        for event in events:
+            profiling.report(event)
+        if error is None:
+            summary["written"].append(pdf_out_file)
+            if stats is not None:
+                summary["sizes"].append((pdf_out_file, stats["plain_bytes"],
+                                         stats["bytes"]))
+            if manifest is not None and pdf_out_file in keys:
+                manifest.record(pdf_out_file, data_file, keys[pdf_out_file])
+        else:
+            summary["failed"].append((data_file, error))
+            if manifest is not None:
+                manifest.forget(output_path(data_file, outdir))
+    if manifest is not None:
+        manifest.save()
+    return summary
+
+
+def run_archive(data_files, archive, engine="acroform", workers=None,
+                template="DDAH.pdf", flatten=False, compact=None,
+                incremental=False, archive_format=None):
+    """
+    Generate one form per file in data_files with a pool of workers and
+    write them into archive, a ZIP or tar archive path, "-" for stdout, or
+    a binary file object (see archive.ArchiveWriter). Entries are named
+    <course code>/<TA name>.pdf and added in the order of data_files, as
+    soon as each form is ready; no PDF file is written.
+
+    Returns a summary dict like run_batch, where "written" lists the entry
+    names.
+    """
+
+    _check_options(engine, flatten)
+    if compact is not None and incremental:
+        raise ValueError("Forms cannot be both compact and incremental")
+    engine = resolve_engine(engine, template, flatten, compact, incremental)
+    course_code = INFO_FIELDS.get("Course Code")
+
+    summary = {"written": [], "failed": []}
+    if compact is not None:
+        summary["sizes"] = []
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(data_files)) or 1
+    pool = None
+    if workers == 1:
+        _init_worker(engine, template, flatten=flatten, compact=compact,
+                     incremental=incremental)
+        results = (_render(data_file) for data_file in data_files)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(engine, template,
+                                              profiling.enabled(), flatten,
+                                              compact, incremental))
+        chunksize = max(1, len(data_files) // (workers * 16))
+        results = pool.imap(_render, data_files, chunksize)
+    try:
+        with ArchiveWriter(archive, archive_format) as writer:
+            for data_file, name, data, error, events, stats in results:
+                for event in events:
+                    profiling.report(event)
+                if error is not None:
+                    summary["failed"].append((data_file, error))
+                    continue
+                entry = writer.entry_name(name, course_code)
+                writer.write(entry, data)
+                summary["written"].append(entry)
+                if stats is not None:
+                    summary["sizes"].append((entry, stats["plain_bytes"],
+                                             stats["bytes"]))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return summary
+
+
+def combine_forms(filled_pdfs):
+    """
+    Return a PdfWriter with the pages of every filled form in filled_pdfs.
+
+    The root form field of each form is renamed (form1[0] becomes
+    TA1_form1[0], TA2_form1[0], ...) so viewers keep the TAs' values
+    apart, and all fields go into one AcroForm. The XFA form description
+    of the template only describes a single form, so it is dropped.
+    Flattened forms have no fields and are added as they are.
+    """
+    writer = PdfWriter()
+    fields = PdfArray()
+    acroform = None
+    for number, filled_pdf in enumerate(filled_pdfs, 1):
+        writer.addpages(filled_pdf.pages)
+        if filled_pdf.Root.AcroForm is None:
+            continue
+        acroform = filled_pdf.Root.AcroForm
+        for field in acroform.Fields:
+            field.T = PdfString.encode(
+                "TA{0}_{1}".format(number, field.T.to_unicode()))
+            fields.append(field)
+
+    if acroform is not None:
+        writer.trailer.Root.AcroForm = PdfDict(
+            Fields=fields,
+            DA=acroform.DA,
+            DR=acroform.DR)
+    return writer
+
+
+def run_combined(data_files, pdf_out_file, engine="acroform",
+                 template="DDAH.pdf", flatten=False, compact=None):
+    """
+    Fill one form per file in data_files and write them all into the
+    single PDF pdf_out_file. Returns a summary dict like run_batch, where
+    "written" lists the data files that made it into the PDF and "sizes"
+    (with compact) holds the sizes of the combined PDF.
+    """
+    _check_options(engine, flatten)
+    engine = resolve_engine(engine, template, flatten, compact)
+    _init_worker(engine, template, flatten=flatten)
+
+    summary = {"written": [], "failed": []}
+
+    # A generator, so only the pages and fields of each filled form are
+    # kept until the final write, not the rest of its object graph.
+    def filled_pdfs():
+        for data_file in data_files:
+            try:
+                with profiling.ta(data_file):
+                    with profiling.stage("parse_data"):
+                        ta_data = parse_data(data_file)
+                    filled_pdf = _WORKER["engine"].fill(ta_data)
+            except Exception as e:
+                summary["failed"].append(
+                    (data_file, "{0}: {1}".format(type(e).__name__, e)))
+                continue
+            summary["written"].append(data_file)
+            yield filled_pdf
+
+    writer = combine_forms(filled_pdfs())
+    if summary["written"]:
+        with profiling.stage("pdf_write"):
+            if compact is None:
+                writer.write(pdf_out_file)
+            else:
+                stats = write_compact(pdf_out_file, writer, compact)
+                summary["sizes"] = [(pdf_out_file, stats["plain_bytes"],
+                                     stats["bytes"])]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate DDAH forms for many TA data files.")
+    parser.add_argument("paths", nargs="+",
+                        help="TA data files, directories or glob patterns")
+    parser.add_argument("-o", "--outdir",
+                        help="write PDFs here instead of next to each input")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--combined", metavar="PDF",
+                        help="write all forms into this single PDF instead")
+    parser.add_argument("--archive", metavar="FILE",
+                        help="write all forms into this ZIP or tar archive "
+                             "instead, or to stdout if FILE is -")
+    parser.add_argument("--archive-format", choices=("zip", "tar", "tar.gz"),
+                        help="archive format (default: from the FILE "
+                             "extension, zip for stdout)")
+    parser.add_argument("--manifest", metavar="JSON",
+                        help="build manifest; skip TAs whose inputs did "
+                             "not change since the last run")
+    parser.add_argument("--flatten", action="store_true",
+                        help="turn the form fields into static content")
+    parser.add_argument("--compact", metavar="LEVEL", type=int, nargs="?",
+                        const=DEFAULT_LEVEL, choices=range(10),
+                        help="write compressed object streams; LEVEL 1 is "
+                             "fastest, 9 smallest (default: {0})".format(
+                                 DEFAULT_LEVEL))
+    parser.add_argument("--incremental", action="store_true",
+                        help="append the filled fields to an unchanged "
+                             "copy of the template")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="record per-stage timings into FILE")
+    parser.add_argument("--profile-format", choices=("json", "chrome"),
+                        default="json",
+                        help="per-stage totals and events as JSON, or a "
+                             "Chrome trace (default: json)")
+    parser.add_argument("--engine", choices=sorted(ENGINES) + ["auto"],
+                        default="acroform",
+                        help="fill engine; auto picks the fastest correct "
+                             "one for the template (see engines.py)")
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+    if args.combined and args.manifest:
+        parser.error("--manifest cannot be used with --combined")
+    if args.archive and (args.combined or args.manifest):
+        parser.error("--archive cannot be used with --combined or "
+                     "--manifest")
+    if args.archive and args.archive_format is None and args.archive != "-":
+        if guess_format(args.archive) is None:
+            parser.error("cannot tell the archive format of {0}, use "
+                         "--archive-format".format(args.archive))
+    if args.flatten and args.engine not in ("acroform", "auto"):
+        parser.error("--flatten only works with the acroform engine")
+    if args.incremental and (args.combined or args.compact is not None):
+        parser.error("--incremental cannot be used with --combined or "
+                     "--compact")
+
+    recorder = None
+    if args.profile:
+        recorder = profiling.Recorder()
+        profiling.add_callback(recorder)
+
+    # Keep stdout for the archive
+    out = sys.stderr if args.archive == "-" else sys.stdout
+    if args.engine == "auto":
+        try:
+            args.engine, report = choose_engine(
+                args.template, args.flatten, args.compact, args.incremental)
+        except ValueError as e:
+            parser.error(str(e))
+        for line in format_report(report, args.engine):
+            print(line, file=out)
+
+    data_files = find_data_files(args.paths)
+    # The run_* functions raise ValueError before generating anything, for
+    # a template that cannot be loaded or outputs that would collide
+    try:
+        if args.combined:
+            summary = run_combined(data_files, args.combined, args.engine,
+                                   args.template, args.flatten, args.compact)
+        elif args.archive:
+            summary = run_archive(data_files, args.archive, args.engine,
+                                  args.workers, args.template, args.flatten,
+                                  args.compact, args.incremental,
+                                  args.archive_format)
+        else:
+            summary = run_batch(data_files, args.outdir, args.engine,
+                                args.workers, args.template, args.manifest,
+                                args.flatten, args.compact, args.incremental)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if recorder is not None:
+        profiling.remove_callback(recorder)
+        if args.profile_format == "chrome":
+            recorder.write_chrome_trace(args.profile)
+        else:
+            recorder.write_json(args.profile)
+
+    print("{0} forms written, {1} up to date, {2} failed".format(
+        len(summary["written"]), len(summary.get("up_to_date", [])),
+        len(summary["failed"])), file=out)
+    if summary.get("sizes"):
+        plain = sum(size[1] for size in summary["sizes"])
+        compact = sum(size[2] for size in summary["sizes"])
+        print("compact output: {0} bytes saved per form ({1:.0%})".format(
+            (plain - compact) // len(summary["written"]),
+            1 - compact / plain), file=out)
+    for data_file, error in summary["failed"]:
+        print("  {0}: {1}".format(data_file, error), file=out)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Benchmark the fill engines on synthetic TA records.
+
+Sample Usage:
+
+    python benchmark.py
+    python benchmark.py --sizes 1 100 --engines acroform fdf -o bench.json
+
+For every engine and batch size, TA data files shaped like sample_data.txt
+are generated, then parse_data, filling and output writing are timed
+separately. Each case runs in a fresh process so its peak RSS is its own.
+The results (throughput, peak RSS, output bytes per form) are written as
+JSON, to compare engines and to catch regressions between releases.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import pdfrw
+
+# The activities of sample_data.txt, by category
+SAMPLE_ACTIVITIES = [
+    ("CONTACT HOURS", ["Lab/tutorial hours", "In-lecture support hours",
+                       "Office hours"]),
+    ("MARKING HOURS", ["Test/quiz marking hours", "Exam marking hours",
+                       "Midterm marking hours", "Assignment marking hours"]),
+    ("PREP HOURS", ["Lab/tutorial prep hours", "Office hours prep hours",
+                    "Meetings with instructors"]),
+    ("INVIGILATION HOURS", ["Midterm invigilation", "Exam invigilation"]),
+]
+
+ENGINES = ("acroform", "overlay", "fdf")
+
+DEFAULT_SIZES = (1, 100, 10000)
+
+
+def synthetic_ta_text(number, rng):
+    """
+    Return the data file text of a random TA in the sample_data.txt format.
+    """
+    lines = []
+    total = 0
+    for category, activities in SAMPLE_ACTIVITIES:
+        lines.append("")
+        lines.append(category + ":")
+        for activity in activities:
+            # Some activities are left at 0, as in the sample
+            hours = rng.choice([0, 0, rng.randint(1, 40)])
+            lines.append("{0}: {1}".format(activity, hours))
+            total += hours
+    header = ["==============",
+              "TA INFO:",
+              "Full Name: Synthetic TA {0}".format(number),
+              "Total contract hours: {0}".format(total)]
+    return "\n".join(header + lines + ["==============", ""])
+
+
+def write_synthetic_files(directory, count, seed=0):
+    """
+    Write count synthetic TA data files into directory and return their
+    paths.
+    """
+    rng = random.Random(seed)
+    data_files = []
+    for number in range(count):
+        data_file = os.path.join(directory, "ta{0}.txt".format(number))
+        with open(data_file, "w") as f:
+            f.write(synthetic_ta_text(number, rng))
+        data_files.append(data_file)
+    return data_files
+
+
+def _engine_functions(engine, template):
+    """
+    Return (parse_data, fill, write) for engine. fill turns a TA record
+    into a document and write serializes the document into a file object.
+    """
+    from engines import get_engine
+    from roster import parse_data
+
+    engine = get_engine(engine, template)
+
+    def write(document, f):
+        engine.write(f, document)
+
+    return parse_data, engine.fill, write
+
+
+def run_case(engine, data_files, template="DDAH.pdf"):
+    """
+    Time parsing, filling and writing the forms of data_files with engine.
+    Meant to run in its own process; returns a result dict.
+    """
+    from template_cache import load_template
+
+    # One-time setup: importing the engine and loading the template
+    start = time.perf_counter()
+    parse_data, fill, write = _engine_functions(engine, template)
+    if engine != "fdf":
+        load_template(template)
+    template_s = time.perf_counter() - start
+
+    parse_s = fill_s = write_s = 0.0
+    output_bytes = 0
+    for data_file in data_files:
+        start = time.perf_counter()
+        ta_data = parse_data(data_file)
+        parsed = time.perf_counter()
+        document = fill(ta_data)
+        filled = time.perf_counter()
+        # Serialize into memory: the disk is not what is being measured
+        out = io.BytesIO()
+        write(document, out)
+        written = time.perf_counter()
+
+        parse_s += parsed - start
+        fill_s += filled - parsed
+        write_s += written - filled
+        output_bytes += len(out.getvalue())
+
+    forms = len(data_files)
+    total_s = template_s + parse_s + fill_s + write_s
+    return {"engine": engine,
+            "forms": forms,
+            "template_s": template_s,
+            "parse_s": parse_s,
+            "fill_s": fill_s,
+            "write_s": write_s,
+            "total_s": total_s,
+            "forms_per_s": forms / total_s if total_s else None,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "bytes_per_form": output_bytes / forms if forms else None}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, engines=ENGINES, template="DDAH.pdf",
+                   seed=0, report=None):
+    """
+    Run every (engine, size) case in a fresh process and return the list
+    of result dicts. report, if given, is called with each result.
+    """
+    context = multiprocessing.get_context("spawn")
+    directory = tempfile.mkdtemp(prefix="ddah-bench-")
+    results = []
+    try:
+        data_files = write_synthetic_files(directory, max(sizes), seed)
+        for size in sizes:
+            for engine in engines:
+                pool = context.Pool(1)
+                try:
+                    result = pool.apply(run_case,
+                                        (engine, data_files[:size], template))
+                finally:
+                    pool.close()
+                    pool.join()
+                results.append(result)
+                if report is not None:
+                    report(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the DDAH fill engines.")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=list(DEFAULT_SIZES),
+                        help="numbers of TA records to generate")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES,
+                        default=list(ENGINES))
+    parser.add_argument("--template", default="DDAH.pdf")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="machine-readable results (JSON)")
+    args = parser.parse_args(argv)
+
+    def report(result):
+        print("{engine:>8} {forms:>6} forms: {forms_per_s:8.1f} forms/s, "
+              "peak RSS {peak_rss_kb} kB, {bytes_per_form:.0f} bytes/form"
+              .format(**result))
+
+    results = run_benchmarks(args.sizes, args.engines, args.template,
+                             args.seed, report)
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "pdfrw": pdfrw.__version__,
+                   "results": results}, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
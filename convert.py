@@ -1,23 +1,16 @@
 from pdfrw import PdfReader, PdfWriter
 import pdfrw
 
+from appearance import flatten as flatten_fields, load_appearances
+from field_map import load_field_map
+from profiling import stage
+from roster import (DDAH_CATEGORIES, DDAH_CATEGORY_NAMES, RosterError,
+                    iter_blocks, iter_roster, parse_data, parse_lines)
+from template_cache import load_template
+
 # Annotation Key used by pdfrw
 ANNOT_KEY = '/Annots'
 
-# The values below are the order in wich these categories appear in
-# page 2 of the DDAH forms
-DDAH_CATEGORIES = {"CONTACT HOURS" : 3,
-                   "MARKING HOURS": 4,
-                   "PREP HOURS": 2,
-                   "INVIGILATION HOURS": 5}
-
-# The valeus below are the category names in the page 1 of the DDAH forms
-DDAH_CATEGORY_NAMES = {"CONTACT HOURS" : "Contact Time",
-                       "MARKING HOURS": "Marking/Grading",
-                       "PREP HOURS": "Preparation",
-                       "INVIGILATION HOURS": "Other Duties"}
-
-
 # This is the only key from INFO_FIELDS key that gets reused
 SUPERVISOR_KEY = "Supervising Professor"
 
@@ -37,131 +30,161 @@ APPROVER = "Approver Name Goes Here"
 # TODO: Fill out the date
 DATE = "December 3, 2019"
 
+# Templates with the course fields filled in, see course_template
+_COURSE_TEMPLATES = {}
 
-def parse_data(filename):
+# At most this many courses are kept in _COURSE_TEMPLATES
+MAX_COURSE_TEMPLATES = 64
+
+
+def set_field(template_pdf, fields, name, value, appearances=None):
     """
-    Parse data in filename. See sample_data.txt for an example.
+    Set the value of the logical field name (see field_map.py). If
+    appearances is an AppearanceBuilder, the field also gets an appearance
+    stream showing the value.
     """
-    ta = {
-        "name": "",     # TA full name
-        "total ": 0,    # total contract hours
-        "detailed": [], # materials for the first page
-        "summary": {}   # materials for the second page
-    }
-    category = None
-    total_hours = 0
-
-    for line in open(filename):
-        line = line.strip()
-        if not line or line.startswith("====") or line.startswith("TA INFO"):
-            # skip these lines. they are not meaningful
-            continue
-
-        key, info = line.split(":")
-        key = key.strip()
-
-        if key in DDAH_CATEGORIES:
-            category = key
-
-        if key.startswith("Full Name"):
-            ta["name"] = info.strip()
-        elif key.startswith("Total contract"):
-            ta["total"] = float(info.strip().strip("_"))
-        else:
-            # convert info -> hours, filter out zero hours:
-            info = info.strip("_")
-            if not info:
-                continue
-            hours = float(info)
-            if hours < 0.1:
-                continue
-
-            # detailed hours:
-            ta["detailed"].append((key, category, hours),)
-            # summary hours:
-            assert category is not None
-            if category not in ta["summary"]:
-                ta["summary"][category] = 0
-            ta["summary"][category] += hours
-            # total hours:
-            total_hours += hours
-
-    # verify that the hours add up
-    if total_hours != ta["total"]:
-        raise ValueError("Total contract hours is {0} but {1} hours are assigned".format(ta["total"], total_hours))
-    # verify that there are at most 12 rows in ta["detailed"]
-    if len(ta["detailed"]) > 12:
-        raise ValueError("DDAH form supports at most 12 rows of detailed activity, but there are {0}".format(len(ta["detailed"])))
-
-    return ta
-
-def write_pdf(outfile, ta_data, TEMPLATE="DDAH.pdf"):
-    template_pdf = pdfrw.PdfReader(TEMPLATE)
+    if name not in fields:
+        raise ValueError("Template has no field {0}".format(name))
+    page, index = fields[name][:2]
+    value = '{}'.format(value)
+    if appearances is None:
+        update = pdfrw.PdfDict(V=value)
+    else:
+        update = pdfrw.PdfDict(V=value,
+                               AP=pdfrw.PdfDict(N=appearances.stream(name, value)))
+    template_pdf.pages[page][ANNOT_KEY][index].update(update)
+
+def course_values(info_fields=None, approver=None, date=None):
+    """
+    Return the (logical field name, value) pairs that are the same for
+    every TA of a course. info_fields, approver and date default to
+    INFO_FIELDS, APPROVER and DATE.
+    """
+    info_fields = INFO_FIELDS if info_fields is None else info_fields
+    approver = APPROVER if approver is None else approver
+    date = DATE if date is None else date
+    values = []
 
     # Page 1: Description of Duties
-    annotations = template_pdf.pages[0][ANNOT_KEY]
-    for index, annotation in enumerate(annotations):
-        key = annotation['/TU']
-        if key:
-            key = key[1:-2] # Remove "(" at beginning and ":)" and end of string
-            if key in INFO_FIELDS:
-                value = INFO_FIELDS[key]
-                annotation.update(
-                    pdfrw.PdfDict(V='{}'.format(value))
-                )
+    for key, value in info_fields.items():
+        values.append(("info:" + key, value))
+
+    # PAGE TWO: Information
+    values.append(("prepared_by", info_fields[SUPERVISOR_KEY]))
+    values.append(("approved_by", approver))
+    for i in [1, 2, 3]: # Date fields
+        values.append(("date:{0}".format(i), date))
+
+    return values
+
+def ta_values(ta_data):
+    """
+    Return the (logical field name, value) pairs that are specific to the
+    TA in ta_data.
+    """
+    values = []
 
     # Page 1: Allocations of Hours (Detailed)
-    annotations = template_pdf.pages[0][ANNOT_KEY]
     for i, (task, category, hour) in enumerate(ta_data["detailed"]):
+        row = "detailed:{0}:".format(i + 1)
         # The "#" field
-        annotations[12 + 7 * i].update(
-            pdfrw.PdfDict(V='{}'.format((i + 1)))
-        )
+        values.append((row + "number", i + 1))
         # The "Responsibility/Activity" field
-        annotations[12 + 7 * i + 1].update(
-            pdfrw.PdfDict(V='{}'.format(task))
-        )
+        values.append((row + "activity", task))
         # The "Hour" field
-        annotations[12 + 7 * i + 4].update(
-            pdfrw.PdfDict(V='{}'.format(hour))
-        )
+        values.append((row + "hours", hour))
         # The "Category" field"
-        annotations[12 + 7 * i + 6].update(
-            pdfrw.PdfDict(V='{}'.format(DDAH_CATEGORY_NAMES[category]))
-        )
+        values.append((row + "category", DDAH_CATEGORY_NAMES[category]))
     # Page 1 Total:
-    annotations[96].update(
-        pdfrw.PdfDict(V='{}'.format(ta_data["total"]))
-    )
+    values.append(("detailed:total", ta_data["total"]))
 
 
     # PAGE TWO: SUMMARY
-    annotations = template_pdf.pages[1][ANNOT_KEY]
     for category, index in DDAH_CATEGORIES.items():
         if category in ta_data["summary"]:
-            annotations[index*2].update(
-                pdfrw.PdfDict(V='{}'.format(ta_data["summary"][category]))
-            )
-    annotations[12].update(
-        pdfrw.PdfDict(V='{}'.format(ta_data["total"]))
-    )
+            values.append(("summary:{0}".format(index),
+                           ta_data["summary"][category]))
+    values.append(("summary:total", ta_data["total"]))
 
     # PAGE TWO: Information
-    annotations[23].update( # Prepared by
-        pdfrw.PdfDict(V='{}'.format(INFO_FIELDS[SUPERVISOR_KEY]))
-    )
-    annotations[24].update( # Approved By
-        pdfrw.PdfDict(V='{}'.format(APPROVER))
-    )
-    annotations[25].update( # Accepted By
-        pdfrw.PdfDict(V='{}'.format(ta_data["name"]))
-    )
-    for i in [26, 27, 28]: # Date fields
-        annotations[i].update(
-            pdfrw.PdfDict(V='{}'.format(DATE))
-        )
-
-    PdfWriter().write(outfile, template_pdf)
+    values.append(("accepted_by", ta_data["name"]))
+
+    return values
+
+def form_values(ta_data, info_fields=None, approver=None, date=None):
+    """
+    Return the (logical field name, value) pairs to fill in for ta_data.
+    See field_map.py for the field names. info_fields, approver and date
+    default to INFO_FIELDS, APPROVER and DATE.
+    """
+    return course_values(info_fields, approver, date) + ta_values(ta_data)
+
+def course_template(TEMPLATE="DDAH.pdf", info_fields=None, approver=None,
+                    date=None, appearances=True):
+    """
+    Return a TemplateCache of TEMPLATE with the course fields (see
+    course_values) already filled in. It is built once per course, and
+    each TA of the course then only fills in its own fields.
+    """
+    template = load_template(TEMPLATE)
+    values = course_values(info_fields, approver, date)
+    key = (template, tuple((name, '{}'.format(value))
+                           for name, value in values), appearances)
+    course = _COURSE_TEMPLATES.get(key)
+    if course is None:
+        fields = load_field_map(TEMPLATE)
+        builder = load_appearances(TEMPLATE) if appearances else None
+
+        def fill(template_pdf):
+            for name, value in values:
+                set_field(template_pdf, fields, name, value, builder)
+
+        with stage("course_fields"):
+            if len(_COURSE_TEMPLATES) >= MAX_COURSE_TEMPLATES:
+                _COURSE_TEMPLATES.clear()
+            course = _COURSE_TEMPLATES[key] = template.derive(fill)
+    return course
+
+def fill_pdf(ta_data, TEMPLATE="DDAH.pdf", appearances=True, flatten=False,
+             info_fields=None, approver=None, date=None):
+    """
+    Return a copy of TEMPLATE with the form fields filled in for ta_data.
+
+    With appearances, every filled field gets an appearance stream, so
+    viewers and printers show it without laying it out themselves. With
+    flatten, the fields are turned into static page content. info_fields,
+    approver and date default to INFO_FIELDS, APPROVER and DATE.
+    """
+    # The template is parsed once per process, and its course fields are
+    # filled once per course; each TA gets its own copy of that
+    appearances = appearances or flatten
+    template_pdf = course_template(TEMPLATE, info_fields, approver, date,
+                                   appearances).clone()
+    fields = load_field_map(TEMPLATE)
+    builder = load_appearances(TEMPLATE) if appearances else None
+
+    with stage("fill_fields"):
+        for name, value in ta_values(ta_data):
+            set_field(template_pdf, fields, name, value, builder)
+        if flatten:
+            flatten_fields(template_pdf)
+
+    return template_pdf
+
+def write_pdf(outfile, ta_data, TEMPLATE="DDAH.pdf", flatten=False,
+              incremental=False):
+    """
+    Fill the form for ta_data and write it to outfile. With incremental,
+    the template is copied as it is and only the filled fields are
+    appended to it (see incremental.py).
+    """
+    template_pdf = fill_pdf(ta_data, TEMPLATE, flatten=flatten)
+    with stage("pdf_write"):
+        if incremental:
+            from incremental import write_incremental
+            write_incremental(outfile, template_pdf, TEMPLATE)
+        else:
+            PdfWriter().write(outfile, template_pdf)
 
 
 if __name__ == "__main__":
@@ -169,6 +192,8 @@ if __name__ == "__main__":
 
     data_file = sys.argv[1]
     pdf_out_file = sys.argv[2]
+    flatten = "--flatten" in sys.argv[3:]
+    incremental = "--incremental" in sys.argv[3:]
 
     ta_data = parse_data(data_file)
-    write_pdf(pdf_out_file, ta_data)
+    write_pdf(pdf_out_file, ta_data, flatten=flatten, incremental=incremental)
@@ -0,0 +1,273 @@
+"""
+Generate the DDAH forms of a whole department, for many courses at once.
+
+Sample Usage:
+
+    python department.py term.json
+    python department.py --engine overlay --compact -o out/ term.json
+    python department.py --archive term.zip term.json
+
+The courses are described in a JSON config file:
+
+    {
+      "approver": "Jane Chair",
+      "date": "September 8, 2020",
+      "info": {"Department": "MCS"},
+      "courses": [
+        {"info": {"Course Code": "CSC338",
+                  "Course Title": "Numerical Methods",
+                  "Tutorial Category": "Skills Development",
+                  "Supervising Professor": "Lisa Zhang",
+                  "Est. Enrolment / TA Section": 30,
+                  "Expected Enrolment (course)": 90},
+         "tas": ["csc338/", "csc338_roster.csv"]},
+        ...
+      ]
+    }
+
+"info" holds the INFO_FIELDS of the form; the top-level "info", "approver"
+and "date" apply to every course that does not set its own. "tas" lists TA
+data files, directories of them, glob patterns, multi-TA rosters (see
+convert.iter_roster) and CSV/TSV rosters (see roster_csv.py), relative to
+the config file.
+
+Everything runs in one process, course by course: the course fields (or
+the overlay's course layer) are filled in once per course and every TA of
+the course starts from that. The module-level defaults (INFO_FIELDS,
+APPROVER, DATE) are never modified. Forms are written to
+OUTDIR/<course code>/<TA name>.pdf, or with --archive, to the same names
+inside one ZIP or tar archive (see archive.py).
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+from archive import ArchiveWriter, guess_format
+
+from batch import find_data_files
+from naming import file_name, ta_output_path
+from compact import DEFAULT_LEVEL
+from convert import INFO_FIELDS, iter_roster
+from engines import (PDF_ENGINES as ENGINES, choose_engine, format_report,
+                     get_engine, resolve_engine)
+
+COURSE_CODE_KEY = "Course Code"
+
+# Extensions of the rosters read by roster_csv.load_csv
+CSV_EXTENSIONS = (".csv", ".tsv", ".tab")
+
+
+class Course(object):
+    """
+    One course of a department config: its form fields and TA sources.
+    """
+
+    def __init__(self, info_fields, approver, date, sources):
+        self.info_fields = info_fields
+        self.approver = approver
+        self.date = date
+        self.sources = sources
+
+    @property
+    def code(self):
+        return self.info_fields[COURSE_CODE_KEY]
+
+
+def _info_key(name):
+    """
+    Return the INFO_FIELDS key for name; "Expected Enrolment (course)" may
+    be written without the backslashes of the PDF field name.
+    """
+    if name in INFO_FIELDS:
+        return name
+    escaped = name.replace("(", "\\(").replace(")", "\\)")
+    if escaped in INFO_FIELDS:
+        return escaped
+    raise ValueError("Unknown form field {0!r}, expected one of {1}".format(
+        name, ", ".join(sorted(INFO_FIELDS))))
+
+
+def load_config(path):
+    """
+    Read a department config file and return its list of Courses.
+    Course codes must be unique, also as directory names (see
+    naming.file_name), since each course writes its own directory.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    defaults = dict((_info_key(name), value)
+                    for name, value in config.get("info", {}).items())
+    courses = []
+    # file_name(course code) -> number of the course using it
+    directories = {}
+    for number, entry in enumerate(config.get("courses", []), 1):
+        info_fields = dict(defaults)
+        for name, value in entry.get("info", {}).items():
+            info_fields[_info_key(name)] = value
+        missing = [name for name in INFO_FIELDS if name not in info_fields]
+        approver = entry.get("approver", config.get("approver"))
+        date = entry.get("date", config.get("date"))
+        if approver is None:
+            missing.append("approver")
+        if date is None:
+            missing.append("date")
+        if missing:
+            raise ValueError("{0}: course {1} has no {2}".format(
+                path, info_fields.get(COURSE_CODE_KEY, number),
+                ", ".join(missing)))
+        # Same key order as INFO_FIELDS, like the form
+        info_fields = dict((name, info_fields[name]) for name in INFO_FIELDS)
+        directory = file_name(info_fields[COURSE_CODE_KEY])
+        if directory in directories:
+            raise ValueError("{0}: courses {1} and {2} both have course code "
+                             "{3!r}".format(path, directories[directory],
+                                           number,
+                                           info_fields[COURSE_CODE_KEY]))
+        directories[directory] = number
+        sources = [os.path.join(base, source)
+                   for source in entry.get("tas", [])]
+        courses.append(Course(info_fields, approver, date, sources))
+    return courses
+
+
+def course_records(course, errors):
+    """
+    Yield the TAs of course, from all of its sources. Invalid TAs are
+    appended to errors as (source, message) pairs.
+    """
+    for source in find_data_files(course.sources):
+        problems = []
+        try:
+            if source.lower().endswith(CSV_EXTENSIONS):
+                from roster_csv import load_csv
+                for ta_data in load_csv(source).ta_records(problems):
+                    yield ta_data
+            else:
+                for ta_data in iter_roster(source, problems):
+                    yield ta_data
+        except (IOError, ValueError) as e:
+            problems.append(e)
+        for problem in problems:
+            errors.append((source, str(problem)))
+
+
+def run_department(courses, outdir=".", engine="acroform",
+                   template="DDAH.pdf", flatten=False, compact=None,
+                   archive=None, archive_format=None):
+    """
+    Fill and write the forms of every TA of courses, one course at a time.
+    If archive is given (a path, "-" for stdout, or a binary file object),
+    the forms are written into that ZIP or tar archive instead of outdir.
+
+    Returns a summary dict with the list of "written" PDF paths (or entry
+    names) and the list of "failed" (source, error message) pairs, plus
+    the same per course code under "courses".
+    """
+    if engine not in ENGINES and engine != "auto":
+        raise ValueError("Unknown engine {0}, expected one of {1}".format(
+            engine, ", ".join(sorted(ENGINES) + ["auto"])))
+    if flatten and engine not in ("acroform", "auto"):
+        raise ValueError("Only the acroform engine can flatten forms")
+    engine = get_engine(resolve_engine(engine, template, flatten, compact),
+                        template, flatten, compact)
+
+    writer = None
+    if archive is not None:
+        writer = ArchiveWriter(archive, archive_format)
+
+    summary = {"written": [], "failed": [], "courses": {}}
+    try:
+        for course in courses:
+            course_dir = os.path.join(outdir, file_name(course.code))
+            if writer is None and not os.path.isdir(course_dir):
+                os.makedirs(course_dir)
+            result = {"written": [], "failed": []}
+            used = {}
+            for ta_data in course_records(course, result["failed"]):
+                try:
+                    filled_pdf = engine.fill(ta_data, course.info_fields,
+                                             course.approver, course.date)
+                    if writer is None:
+                        pdf_out_file = ta_output_path(course_dir,
+                                                      ta_data["name"], used)
+                        engine.write(pdf_out_file, filled_pdf)
+                    else:
+                        out = io.BytesIO()
+                        engine.write(out, filled_pdf)
+                        pdf_out_file = writer.entry_name(ta_data["name"],
+                                                         course.code)
+                        writer.write(pdf_out_file, out.getvalue())
+                except Exception as e:
+                    result["failed"].append(
+                        (ta_data["name"],
+                         "{0}: {1}".format(type(e).__name__, e)))
+                    continue
+                result["written"].append(pdf_out_file)
+            summary["courses"][course.code] = result
+            summary["written"].extend(result["written"])
+            summary["failed"].extend(result["failed"])
+    finally:
+        if writer is not None:
+            writer.close()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate the DDAH forms of many courses.")
+    parser.add_argument("config", help="department config (JSON)")
+    parser.add_argument("-o", "--outdir", default=".",
+                        help="write OUTDIR/<course code>/<TA name>.pdf")
+    parser.add_argument("--archive", metavar="FILE",
+                        help="write the forms into this ZIP or tar archive "
+                             "instead, or to stdout if FILE is -")
+    parser.add_argument("--archive-format", choices=("zip", "tar", "tar.gz"),
+                        help="archive format (default: from the FILE "
+                             "extension, zip for stdout)")
+    parser.add_argument("--engine", choices=sorted(ENGINES) + ["auto"],
+                        default="acroform",
+                        help="fill engine; auto picks the fastest correct "
+                             "one for the template (see engines.py)")
+    parser.add_argument("--template", default="DDAH.pdf")
+    parser.add_argument("--flatten", action="store_true",
+                        help="turn the form fields into static content")
+    parser.add_argument("--compact", metavar="LEVEL", type=int, nargs="?",
+                        const=DEFAULT_LEVEL, choices=range(10),
+                        help="write compressed object streams")
+    args = parser.parse_args(argv)
+    if args.flatten and args.engine not in ("acroform", "auto"):
+        parser.error("--flatten only works with the acroform engine")
+    if args.archive and args.archive_format is None and args.archive != "-":
+        if guess_format(args.archive) is None:
+            parser.error("cannot tell the archive format of {0}, use "
+                         "--archive-format".format(args.archive))
+
+    # Keep stdout for the archive
+    out = sys.stderr if args.archive == "-" else sys.stdout
+    try:
+        courses = load_config(args.config)
+        if args.engine == "auto":
+            args.engine, report = choose_engine(args.template, args.flatten,
+                                                args.compact)
+            for line in format_report(report, args.engine):
+                print(line, file=out)
+    except ValueError as e:
+        parser.error(str(e))
+    summary = run_department(courses, args.outdir, args.engine,
+                             args.template, args.flatten, args.compact,
+                             args.archive, args.archive_format)
+
+    for code, result in summary["courses"].items():
+        print("{0}: {1} forms written, {2} failed".format(
+            code, len(result["written"]), len(result["failed"])), file=out)
+        for source, error in result["failed"]:
+            print("  {0}: {1}".format(source, error), file=out)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
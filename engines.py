@@ -0,0 +1,575 @@
+"""
+One interface for the ways of filling in a DDAH form.
+
+Sample Usage:
+
+    from engines import choose_engine, get_engine
+
+    engine = get_engine("overlay", "DDAH.pdf")
+    engine.write("out.pdf", engine.fill(ta_data))
+
+    name, report = choose_engine("DDAH.pdf")    # what --engine auto does
+
+    python engines.py --template DDAH.pdf sample_data.txt
+
+Engines:
+
+    acroform  fill in the form fields with pdfrw (convert.py)
+    overlay   draw the values over the template pages (convert-overlay.py)
+    fdf       write only the field values, as an FDF file to import into
+              the template (fdf.py); not a PDF, so not used for batches
+
+Every engine takes a parsed TA record (see roster.parse_lines) plus the
+course fields, and can read back the field values its own output shows
+(read_values): the text of the filled fields, or the text drawn inside
+each field's box for the overlay. check() compares them to the values the
+form should show (convert.form_values), so the outputs of all engines are
+held to the same field values; cost() times filling and writing a form.
+
+choose_engine runs that calibration on a sample TA and returns the fastest
+engine whose output is correct for the template, e.g. an overlay whose
+hard-coded positions no longer match a revised template is never chosen.
+The choice is kept per template for the rest of the process.
+"""
+import argparse
+import base64
+import importlib
+import io
+import os
+import re
+import sys
+import time
+import zlib
+
+from pdfrw import PdfName, PdfReader, PdfString, PdfTokens, PdfWriter
+
+from compact import write_compact
+from convert import form_values
+from field_map import load_field_map
+from incremental import write_incremental
+from roster import DDAH_CATEGORIES, parse_data
+from template_cache import load_template
+
+# Annotation Key used by pdfrw
+ANNOT_KEY = '/Annots'
+
+# Forms timed per engine by cost(), after one untimed warm-up
+COST_REPEAT = 3
+
+# Engines that write PDF forms, the only ones choose_engine considers
+PDF_ENGINES = ("acroform", "overlay")
+
+# Engine choices of choose_engine, keyed by (absolute path, modification
+# time) of the template and the options
+_CHOICES = {}
+
+# A text showing operator after its text matrix, as drawn by reportlab
+# and convert-overlay.TextLayer: "a b c d e f Tm (text) Tj"
+_SHOW_TEXT = re.compile(r"((?:[-+\d.]+\s+){6})Tm\s*"
+                        r"(\((?:[^()\\]|\\.)*\)|<[0-9A-Fa-f\s]*>)\s*Tj")
+
+# Overlay text is drawn from its baseline, which may sit a little below
+# the box of the field it is in
+_BASELINE_SLACK = 2
+
+
+def write_form(outfile, filled_pdf, template="DDAH.pdf", compact=None,
+               incremental=False):
+    """
+    Write filled_pdf to outfile (a path or a binary file object): plainly,
+    compactly if compact is a level (see compact.py), or as an incremental
+    update of template (see incremental.py). Returns the write_compact
+    stats, or None.
+    """
+    if compact is not None:
+        return write_compact(outfile, filled_pdf, compact)
+    if incremental:
+        write_incremental(outfile, filled_pdf, template)
+    else:
+        PdfWriter().write(outfile, filled_pdf)
+    return None
+
+
+def _same(expected, actual):
+    """
+    Return whether the value actual shown by a form is the value expected;
+    numbers may be written differently ("30", "30.0").
+    """
+    expected = '{}'.format(expected).strip()
+    actual = actual.strip()
+    if expected == actual:
+        return True
+    try:
+        return float(expected) == float(actual)
+    except ValueError:
+        return False
+
+
+class Engine(object):
+    """
+    A way of filling in the form of template. Subclasses implement fill
+    and read_values.
+    """
+
+    # Name used by --engine
+    name = None
+
+    # Extension of the files the engine writes
+    extension = ".pdf"
+
+    # Whether the engine can turn the fields into static content
+    can_flatten = False
+
+    def __init__(self, template="DDAH.pdf", flatten=False, compact=None,
+                 incremental=False):
+        if flatten and not self.can_flatten:
+            raise ValueError("The {0} engine cannot flatten forms".format(
+                self.name))
+        if compact is not None and incremental:
+            raise ValueError("Forms cannot be both compact and incremental")
+        self.template = template
+        self.flatten = flatten
+        self.compact = compact
+        self.incremental = incremental
+
+    def load(self):
+        """
+        Parse the template now, e.g. once per worker process.
+        """
+        load_template(self.template)
+
+    def fill(self, ta_data, info_fields=None, approver=None, date=None):
+        """
+        Return the filled form for ta_data, for write. info_fields,
+        approver and date default to convert.INFO_FIELDS, APPROVER and
+        DATE.
+        """
+        raise NotImplementedError
+
+    def write(self, outfile, document):
+        """
+        Write the filled form document to outfile (a path or a binary file
+        object). Returns the write_compact stats, or None.
+        """
+        return write_form(outfile, document, self.template, self.compact,
+                          self.incremental)
+
+    def render(self, ta_data, info_fields=None, approver=None, date=None):
+        """
+        Return the bytes of the filled form for ta_data.
+        """
+        out = io.BytesIO()
+        self.write(out, self.fill(ta_data, info_fields, approver, date))
+        return out.getvalue()
+
+    def read_values(self, data):
+        """
+        Return the {logical field name: text} shown by the form data (see
+        field_map.py for the names). Fields showing nothing may be left
+        out.
+        """
+        raise NotImplementedError
+
+    def check(self, ta_data, data=None, info_fields=None, approver=None,
+              date=None):
+        """
+        Compare the field values shown by data (default: a newly rendered
+        form for ta_data) to the values the form should show. Returns the
+        list of problems; empty if the output is correct.
+        """
+        if data is None:
+            data = self.render(ta_data, info_fields, approver, date)
+        shown = self.read_values(data)
+        problems = []
+        expected = form_values(ta_data, info_fields, approver, date)
+        for name, value in expected:
+            actual = shown.pop(name, None)
+            if '{}'.format(value) == "" and not actual:
+                continue
+            if actual is None:
+                problems.append("{0}: expected {1!r}, shows nothing".format(
+                    name, '{}'.format(value)))
+            elif not _same(value, actual):
+                problems.append("{0}: expected {1!r}, shows {2!r}".format(
+                    name, '{}'.format(value), actual))
+        for name, actual in sorted(shown.items()):
+            if actual.strip():
+                problems.append("{0}: expected nothing, shows {1!r}".format(
+                    name, actual))
+        return problems
+
+    def cost(self, ta_data, repeat=COST_REPEAT):
+        """
+        Return the seconds it takes to fill and write one form for
+        ta_data, the best of repeat runs after a warm-up.
+        """
+        self.render(ta_data)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.render(ta_data)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return best
+
+
+class AcroFormEngine(Engine):
+    """
+    Fill in the form fields of the template (convert.fill_pdf).
+    """
+
+    name = "acroform"
+    can_flatten = True
+
+    def fill(self, ta_data, info_fields=None, approver=None, date=None):
+        from convert import fill_pdf
+        return fill_pdf(ta_data, TEMPLATE=self.template,
+                        flatten=self.flatten, info_fields=info_fields,
+                        approver=approver, date=date)
+
+    def read_values(self, data):
+        if self.flatten:
+            raise ValueError("Flattened forms have no field values to read")
+        pages = PdfReader(fdata=data).pages
+        values = {}
+        for name, (page, index) in ((name, entry[:2]) for name, entry in
+                                    load_field_map(self.template).items()):
+            value = pages[page][ANNOT_KEY][index].V
+            if value is not None:
+                values[name] = (value.to_unicode()
+                                if isinstance(value, PdfString)
+                                else str(value))
+        return values
+
+
+class OverlayEngine(Engine):
+    """
+    Draw the values over the pages of the template
+    (convert-overlay.fill_pdf_overlay).
+
+    Like the other engines, it fills with convert.py's INFO_FIELDS,
+    APPROVER and DATE by default, not with the placeholder defaults of the
+    convert-overlay.py script, so --engine overlay and --engine acroform
+    show the same values.
+    """
+
+    name = "overlay"
+
+    def fill(self, ta_data, info_fields=None, approver=None, date=None):
+        # convert-overlay.py has defaults of its own; engines share convert's
+        from convert import APPROVER, DATE, INFO_FIELDS
+        module = importlib.import_module("convert-overlay")
+        return module.fill_pdf_overlay(
+            ta_data, TEMPLATE=self.template,
+            info_fields=INFO_FIELDS if info_fields is None else info_fields,
+            approver=APPROVER if approver is None else approver,
+            date=DATE if date is None else date)
+
+    def field_boxes(self):
+        """
+        Return the {page index: [(logical field name, box)]} of the
+        template's fields, where box is (x0, y0, x1, y1).
+        """
+        pages = load_template(self.template).template.pages
+        boxes = {}
+        for name, (page, index) in ((name, entry[:2]) for name, entry in
+                                    load_field_map(self.template).items()):
+            rect = [float(n) for n in pages[page][ANNOT_KEY][index].Rect]
+            box = (min(rect[0], rect[2]), min(rect[1], rect[3]),
+                   max(rect[0], rect[2]), max(rect[1], rect[3]))
+            boxes.setdefault(page, []).append((name, box))
+        return boxes
+
+    def read_values(self, data):
+        """
+        Return the text drawn inside the box of each field. The overlays
+        are the form XObjects merged into the pages; text is placed by its
+        text matrix, through the /Matrix of each enclosing XObject.
+        """
+        boxes = self.field_boxes()
+        values = {}
+        for page_index, page in enumerate(PdfReader(fdata=data).pages):
+            drawn = []
+            seen = set()
+            stack = [(page.Resources, (1, 0, 0, 1, 0, 0))]
+            while stack:
+                resources, matrix = stack.pop()
+                for xobject in (resources.XObject or {}).values():
+                    if xobject.Subtype != "/Form" or id(xobject) in seen:
+                        continue
+                    seen.add(id(xobject))
+                    inner = _multiply([float(n) for n in xobject.Matrix or
+                                       (1, 0, 0, 1, 0, 0)], matrix)
+                    drawn.extend((inner, text_matrix, text) for
+                                 text_matrix, text in _shown_text(xobject))
+                    if xobject.Resources is not None:
+                        stack.append((xobject.Resources, inner))
+            for matrix, text_matrix, text in drawn:
+                a, b, c, d, e, f = _multiply(text_matrix, matrix)
+                for name, (x0, y0, x1, y1) in boxes.get(page_index, ()):
+                    if (x0 - _BASELINE_SLACK <= e <= x1 and
+                            y0 - _BASELINE_SLACK <= f <= y1):
+                        values[name] = (values[name] + " " + text
+                                        if name in values else text)
+                        break
+        return values
+
+
+def _multiply(m, n):
+    """
+    Return the PDF matrix m x n, both as (a, b, c, d, e, f).
+    """
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2,
+            c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def _shown_text(xobject):
+    """
+    Yield the (text matrix, text) of the strings shown by the content
+    stream of xobject.
+    """
+    if xobject.stream is None:
+        return
+    stream = xobject.stream
+    filters = xobject.Filter
+    if filters is not None and not isinstance(filters, list):
+        filters = [filters]
+    for name in filters or ():
+        # reportlab writes ASCII85 over Flate
+        if name == PdfName.ASCII85Decode:
+            stream = stream.strip()
+            if stream.startswith("<~"):
+                stream = stream[2:]
+            stream = base64.a85decode(stream.rstrip("~>").encode("latin-1"))
+        elif name == PdfName.FlateDecode:
+            stream = zlib.decompress(stream.encode("latin-1")
+                                     if isinstance(stream, str) else stream)
+        else:
+            return
+        stream = stream.decode("latin-1")
+    for numbers, text in _SHOW_TEXT.findall(stream):
+        yield ([float(n) for n in numbers.split()],
+               PdfString(text).to_unicode())
+
+
+class FdfEngine(Engine):
+    """
+    Write only the field values, as an FDF file to import into the
+    template (see fdf.py).
+    """
+
+    name = "fdf"
+    extension = ".fdf"
+
+    def __init__(self, template="DDAH.pdf", flatten=False, compact=None,
+                 incremental=False):
+        if compact is not None or incremental:
+            raise ValueError("FDF files cannot be compact or incremental")
+        Engine.__init__(self, template, flatten)
+
+    def load(self):
+        import fdf
+        fdf.load_skeleton(self.template)
+
+    def fill(self, ta_data, info_fields=None, approver=None, date=None):
+        import fdf
+        return fdf.load_skeleton(self.template).fdf(
+            form_values(ta_data, info_fields, approver, date))
+
+    def write(self, outfile, document):
+        if hasattr(outfile, "write"):
+            outfile.write(document)
+        else:
+            with open(outfile, "wb") as f:
+                f.write(document)
+        return None
+
+    def read_values(self, data):
+        logical = dict((entry[2], name) for name, entry in
+                       load_field_map(self.template).items())
+        values = {}
+        name = None
+        tokens = iter(PdfTokens(data.decode("latin-1")))
+        for token in tokens:
+            if token == "/T":
+                name = logical.get(PdfString(next(tokens)).to_unicode())
+            elif token == "/V" and name is not None:
+                values[name] = PdfString(next(tokens)).to_unicode()
+                name = None
+        return values
+
+
+# Engines by name
+ENGINES = {"acroform": AcroFormEngine,
+           "overlay": OverlayEngine,
+           "fdf": FdfEngine}
+
+
+def get_engine(name, template="DDAH.pdf", flatten=False, compact=None,
+               incremental=False):
+    """
+    Return the Engine called name for template.
+    """
+    if name not in ENGINES:
+        raise ValueError("Unknown engine {0}, expected one of {1}".format(
+            name, ", ".join(sorted(ENGINES))))
+    return ENGINES[name](template, flatten, compact, incremental)
+
+
+def load_engine(name, template="DDAH.pdf", flatten=False, compact=None,
+                incremental=False):
+    """
+    Return the Engine called name for template, loaded in this process.
+
+    Raises ValueError if the template cannot be loaded (missing,
+    unreadable or not a form). Call this before starting worker processes:
+    a multiprocessing.Pool whose initializer raises keeps starting new
+    workers and never returns a result.
+    """
+    engine = get_engine(name, template, flatten, compact, incremental)
+    try:
+        engine.load()
+    except Exception as e:
+        raise ValueError("Cannot load template {0}: {1}: {2}".format(
+            template, type(e).__name__, e))
+    return engine
+
+
+def sample_ta():
+    """
+    Return a TA record that fills every detailed row and every category of
+    the form, for calibrating the engines.
+    """
+    categories = sorted(DDAH_CATEGORIES)
+    detailed = []
+    summary = {}
+    for row in range(12):
+        category = categories[row % len(categories)]
+        hours = 1.5 + row
+        detailed.append(("Sample activity {0}".format(row + 1), category,
+                         hours))
+        summary[category] = summary.get(category, 0) + hours
+    return {"name": "Sample (TA)",
+            "total": sum(hours for task, category, hours in detailed),
+            "detailed": detailed,
+            "summary": summary}
+
+
+def calibrate(template="DDAH.pdf", ta_data=None, names=PDF_ENGINES,
+              flatten=False, compact=None, incremental=False):
+    """
+    Render the form for ta_data (default: sample_ta()) with each engine in
+    names, check its field values and time it. Returns a list of dicts
+    with the "engine" name, the "seconds" per form (None if it failed) and
+    its list of "problems".
+    """
+    ta_data = sample_ta() if ta_data is None else ta_data
+    report = []
+    for name in names:
+        entry = {"engine": name, "seconds": None, "problems": []}
+        try:
+            engine = get_engine(name, template, flatten, compact, incremental)
+            if flatten:
+                # The values are checked before the fields are flattened
+                checked = get_engine(name, template, False, compact,
+                                     incremental)
+            else:
+                checked = engine
+            entry["problems"] = checked.check(ta_data)
+            entry["seconds"] = engine.cost(ta_data)
+        except Exception as e:
+            entry["problems"].append("{0}: {1}".format(type(e).__name__, e))
+        report.append(entry)
+    return report
+
+
+def choose_engine(template="DDAH.pdf", flatten=False, compact=None,
+                  incremental=False, names=PDF_ENGINES):
+    """
+    Return (name, calibration report) of the fastest engine in names whose
+    forms show the right values for template (see calibrate). The result
+    is kept for the rest of the process, until the template changes.
+
+    Raises ValueError if the template cannot be loaded or no engine gives
+    correct forms.
+    """
+    if flatten:
+        names = tuple(name for name in names if ENGINES[name].can_flatten)
+    load_engine(names[0], template, flatten, compact, incremental)
+    path = os.path.abspath(template)
+    key = (path, os.path.getmtime(path), tuple(names), flatten, compact,
+           incremental)
+    choice = _CHOICES.get(key)
+    if choice is None:
+        report = calibrate(template, None, names, flatten, compact,
+                           incremental)
+        correct = [entry for entry in report if not entry["problems"]]
+        if not correct:
+            raise ValueError("No engine fills {0} correctly: {1}".format(
+                template, "; ".join("{0}: {1}".format(
+                    entry["engine"], entry["problems"][0])
+                    for entry in report)))
+        best = min(correct, key=lambda entry: entry["seconds"])
+        choice = _CHOICES[key] = (best["engine"], report)
+    return choice
+
+
+def resolve_engine(name, template="DDAH.pdf", flatten=False, compact=None,
+                   incremental=False):
+    """
+    Return name, or the engine choose_engine picks if name is "auto".
+    Raises ValueError if the template cannot be loaded (see load_engine).
+    """
+    if name == "auto":
+        return choose_engine(template, flatten, compact, incremental)[0]
+    load_engine(name, template, flatten, compact, incremental)
+    return name
+
+
+def format_report(report, chosen=None):
+    """
+    Return the calibration report as lines of text.
+    """
+    lines = []
+    for entry in report:
+        if entry["seconds"] is None:
+            cost = "failed"
+        else:
+            cost = "{0:.1f} ms/form".format(entry["seconds"] * 1000)
+        status = ("{0} problems".format(len(entry["problems"]))
+                  if entry["problems"] else "correct")
+        mark = " (chosen)" if entry["engine"] == chosen else ""
+        lines.append("{0}: {1}, {2}{3}".format(entry["engine"], cost,
+                                               status, mark))
+        for problem in entry["problems"]:
+            lines.append("  " + problem)
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the fill engines and check their output.")
+    parser.add_argument("data_file", nargs="?",
+                        help="TA data file to calibrate with (default: a "
+                             "sample TA filling every row)")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES),
+                        default=list(PDF_ENGINES))
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+
+    ta_data = parse_data(args.data_file) if args.data_file else None
+    report = calibrate(args.template, ta_data, args.engines)
+    correct = [entry for entry in report if not entry["problems"]]
+    chosen = None
+    if correct:
+        chosen = min(correct, key=lambda entry: entry["seconds"])["engine"]
+    for line in format_report(report, chosen):
+        print(line)
+    return 0 if len(correct) == len(report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
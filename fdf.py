@@ -0,0 +1,228 @@
+"""
+Emit DDAH field values as FDF or XFDF instead of building PDFs.
+
+Sample Usage:
+
+    python fdf.py -o fdf/ tas/
+    python fdf.py --xfdf --archive ddah.zip "tas/*.txt"
+
+The field names (form1[0].Page1[0]...) come from the template's field map
+and are encoded once per process into an FdfSkeleton, so each TA only
+costs escaping and joining its values. The output can be handed to a form
+server, or imported into DDAH.pdf by any FDF-aware viewer.
+"""
+import argparse
+import os
+import sys
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from convert import parse_data, form_values
+from field_map import load_field_map
+from naming import check_output_paths, output_path, unique_name
+from roster import find_data_files
+
+# Skeletons already compiled in this process, keyed by template path
+_SKELETONS = {}
+
+FDF_HEADER = (b'%FDF-1.2\n\n'
+              b'1 0 obj\n'
+              b'<<\n'
+              b'/FDF << /Fields 2 0 R>>\n'
+              b'>>\n'
+              b'endobj\n'
+              b'2 0 obj\n'
+              b'[')
+FDF_FOOTER = (b']\n'
+              b'endobj\n'
+              b'trailer\n'
+              b'<<\n'
+              b'/Root 1 0 R\n\n'
+              b'>>\n'
+              b'%%EOF\n')
+
+XFDF_HEADER = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+               b'<xfdf xmlns="http://ns.adobe.com/xfdf/" xml:space="preserve">\n'
+               b'<fields>\n')
+XFDF_FOOTER = (b'</fields>\n'
+               b'</xfdf>\n')
+
+# Characters that must be escaped inside a PDF literal string
+_PDF_ESCAPES = {ord("\\"): "\\\\", ord("("): "\\(", ord(")"): "\\)",
+                ord("\r"): "\\r", ord("\n"): "\\n", ord("\t"): "\\t",
+                ord("\b"): "\\b", ord("\f"): "\\f"}
+
+
+def pdf_string(value):
+    """
+    Encode value as a PDF string object: an escaped literal string for
+    ASCII text, a UTF-16BE hex string otherwise.
+    """
+    value = '{}'.format(value)
+    try:
+        value.encode("ascii")
+    except UnicodeEncodeError:
+        return b"<FEFF" + value.encode("utf-16-be").hex().upper().encode() + b">"
+    return ("(" + value.translate(_PDF_ESCAPES) + ")").encode("ascii")
+
+
+class FdfSkeleton(object):
+    """
+    The per-template part of an FDF/XFDF document, precompiled from a
+    field map: the encoded field name of every logical field, and its
+    path in the XFDF field hierarchy.
+    """
+
+    def __init__(self, field_map):
+        self.fdf_names = {}
+        self.xfdf_paths = {}
+        for logical, (page, index, name) in field_map.items():
+            self.fdf_names[logical] = b"<< /T " + pdf_string(name) + b" /V "
+            self.xfdf_paths[logical] = tuple(name.split("."))
+
+    def fdf(self, values):
+        """
+        Return the FDF document for values, a list of (logical field
+        name, value) pairs as returned by convert.form_values.
+        """
+        names = self.fdf_names
+        parts = [FDF_HEADER]
+        for logical, value in values:
+            if logical not in names:
+                raise ValueError("Template has no field {0}".format(logical))
+            parts.append(names[logical])
+            parts.append(pdf_string(value))
+            parts.append(b" >>\n")
+        parts.append(FDF_FOOTER)
+        return b"".join(parts)
+
+    def xfdf(self, values):
+        """
+        Return the XFDF document for values, with the fields nested by
+        their qualified names.
+        """
+        tree = {}
+        for logical, value in values:
+            if logical not in self.xfdf_paths:
+                raise ValueError("Template has no field {0}".format(logical))
+            node = tree
+            for part in self.xfdf_paths[logical]:
+                node = node.setdefault(part, {})
+            node[None] = '{}'.format(value)
+
+        parts = [XFDF_HEADER]
+
+        def emit(node):
+            for name, child in node.items():
+                if name is None:
+                    continue
+                parts.append("<field name={0}>".format(quoteattr(name)))
+                if None in child:
+                    parts.append("<value>{0}</value>".format(escape(child[None])))
+                emit(child)
+                parts.append("</field>\n")
+
+        emit(tree)
+        parts = [part if isinstance(part, bytes) else part.encode("utf-8")
+                 for part in parts]
+        parts.append(XFDF_FOOTER)
+        return b"".join(parts)
+
+
+def load_skeleton(template="DDAH.pdf"):
+    """
+    Return the FdfSkeleton for template, compiling it once per process.
+    """
+    skeleton = _SKELETONS.get(template)
+    if skeleton is None:
+        skeleton = _SKELETONS[template] = FdfSkeleton(load_field_map(template))
+    return skeleton
+
+
+def write_fdf_batch(data_files, outdir=None, archive=None, xfdf=False,
+                    template="DDAH.pdf", info_fields=None, approver=None,
+                    date=None):
+    """
+    Write one FDF (or XFDF) per TA data file, either into outdir (default:
+    next to each input) or as entries of the ZIP file archive.
+
+    Returns a summary dict like batch.run_batch: the "written" file or
+    entry names and the "failed" (data_file, error message) pairs.
+
+    Data files with the same name get numbered archive entries (ta.fdf,
+    ta_2.fdf); in outdir they would overwrite each other, so ValueError
+    is raised before anything is written.
+    """
+    skeleton = load_skeleton(template)
+    render = skeleton.xfdf if xfdf else skeleton.fdf
+    extension = ".xfdf" if xfdf else ".fdf"
+    summary = {"written": [], "failed": []}
+
+    # The same file given twice is only written once
+    data_files = list(dict.fromkeys(data_files))
+    if archive is None:
+        check_output_paths(data_files, outdir, extension)
+    # Entry names used so far, see naming.unique_name
+    used = {}
+
+    zip_file = None
+    if archive is not None:
+        zip_file = zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED)
+    elif outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    try:
+        for data_file in data_files:
+            try:
+                ta_data = parse_data(data_file)
+                document = render(form_values(ta_data, info_fields,
+                                              approver, date))
+            except Exception as e:
+                summary["failed"].append(
+                    (data_file, "{0}: {1}".format(type(e).__name__, e)))
+                continue
+
+            if zip_file is not None:
+                stem = os.path.splitext(os.path.basename(data_file))[0]
+                out_file = unique_name(stem, used) + extension
+                zip_file.writestr(out_file, document)
+            else:
+                out_file = output_path(data_file, outdir, extension)
+                with open(out_file, "wb") as f:
+                    f.write(document)
+            summary["written"].append(out_file)
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write DDAH field values as FDF/XFDF for many TA files.")
+    parser.add_argument("paths", nargs="+",
+                        help="TA data files, directories or glob patterns")
+    parser.add_argument("-o", "--outdir",
+                        help="write files here instead of next to each input")
+    parser.add_argument("--archive",
+                        help="write all documents into this ZIP file instead")
+    parser.add_argument("--xfdf", action="store_true",
+                        help="write XFDF instead of FDF")
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = write_fdf_batch(find_data_files(args.paths), args.outdir,
+                                  args.archive, args.xfdf, args.template)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("{0} documents written, {1} failed".format(
+        len(summary["written"]), len(summary["failed"])))
+    for data_file, error in summary["failed"]:
+        print("  {0}: {1}".format(data_file, error))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
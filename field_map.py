@@ -0,0 +1,180 @@
+"""
+Map the logical fields of the DDAH form to annotations in the template.
+
+compile_field_map() scans the template once and resolves every field the
+fillers write to (course information, the 12 detailed rows, the summary,
+signers and dates) to a (page, annotation index) pair, by the field's
+fully qualified /T name or its /TU label. The result is saved next to the
+template as a sidecar file keyed by the template's hash, so later runs
+skip the scan, and a revised template is re-checked instead of silently
+filling the wrong boxes.
+
+Logical field names:
+
+    info:<label>           Page 1 course information, by /TU label
+                           (the keys of INFO_FIELDS)
+    detailed:<n>:number    Page 1 detailed row n (1-12): "#" column
+    detailed:<n>:activity  ... "Responsibility/Activity" column
+    detailed:<n>:hours     ... "Hour" column
+    detailed:<n>:category  ... "Category" dropdown
+    detailed:total         Page 1 total hours
+    summary:<i>            Page 2 summary row i (0-5), the values of
+                           DDAH_CATEGORIES
+    summary:total          Page 2 total hours
+    prepared_by, approved_by, accepted_by
+    date:1, date:2, date:3 Page 2 date fields, top to bottom
+"""
+import json
+import os
+
+from template_cache import load_template, template_hash
+
+# Annotation Key used by pdfrw
+ANNOT_KEY = '/Annots'
+
+# Bump when the sidecar layout or the logical names change
+FIELD_MAP_VERSION = 1
+
+# Number of detailed activity rows on page 1
+DETAILED_ROWS = 12
+
+PAGE1 = "form1[0].Page1[0]."
+PAGE2 = "form1[0].Page2[0].#subform[2]."
+
+# Columns of a detailed row, by the field name inside the row
+DETAILED_COLUMNS = {"number": "Unit{0}[0]",
+                    "activity": "#field[1]",
+                    "hours": "Total[0]",
+                    "category": "DropDownList1[0]"}
+
+# Logical field -> fully qualified field name
+FIXED_FIELDS = {"detailed:total": PAGE1 + "Table3[0].Row6[0].Cell2[0]",
+                "summary:0": PAGE2 + "Table1[1].Row1[0].Total[0]",
+                "summary:1": PAGE2 + "Table1[1].Row2[0].Total[0]",
+                "summary:2": PAGE2 + "Table1[1].Row3[0].Total[0]",
+                "summary:3": PAGE2 + "Table1[1].Row4[0].Total[0]",
+                "summary:4": PAGE2 + "Table1[1].Row5[0].Total[0]",
+                "summary:5": PAGE2 + "Table1[1].Row5[1].Total[0]",
+                "summary:total": PAGE2 + "Table1[1].Row6[0].Cell2[0]",
+                "prepared_by": PAGE2 + "#field[21]",
+                "approved_by": PAGE2 + "#field[22]",
+                "accepted_by": PAGE2 + "#field[23]",
+                "date:1": PAGE2 + "#field[24]",
+                "date:2": PAGE2 + "#field[25]",
+                "date:3": PAGE2 + "#field[26]"}
+
+# Field maps already loaded in this process, keyed by
+# (absolute path, modification time) of the template
+_CACHE = {}
+
+
+def sidecar_path(template="DDAH.pdf"):
+    return template + ".fields.json"
+
+
+def qualified_name(annotation):
+    """
+    Return the fully qualified field name of a widget annotation, e.g.
+    form1[0].Page1[0].Table3[0].Row1[0].Total[0]
+    """
+    parts = []
+    node = annotation
+    while node is not None:
+        if node.T is not None:
+            parts.append(node.T.to_unicode())
+        node = node.Parent
+    return ".".join(reversed(parts))
+
+
+def compile_field_map(template_pdf):
+    """
+    Resolve every logical field to [page index, annotation index,
+    qualified name] in the parsed template_pdf.
+
+    Raises ValueError if the template lacks one of the fields.
+    """
+    by_name = {}
+    field_map = {}
+    for page_index, page in enumerate(template_pdf.pages):
+        for index, annotation in enumerate(page[ANNOT_KEY] or []):
+            name = qualified_name(annotation)
+            if name:
+                by_name[name] = [page_index, index, name]
+            label = annotation.TU
+            if page_index == 0 and label and label.endswith(":)"):
+                # Remove "(" at beginning and ":)" and end of string
+                field_map["info:" + label[1:-2]] = [page_index, index, name]
+
+    # The detailed rows live in differently named table rows, so find
+    # each row through its numbered "#" field and take its siblings.
+    units = {}
+    for name in by_name:
+        parent, _, leaf = name.rpartition(".")
+        if parent.startswith(PAGE1 + "Table3[0]."):
+            units[leaf] = parent
+    for row in range(1, DETAILED_ROWS + 1):
+        parent = units.get(DETAILED_COLUMNS["number"].format(row))
+        for column, leaf in DETAILED_COLUMNS.items():
+            name = "{0}.{1}".format(parent, leaf.format(row))
+            if parent is None or name not in by_name:
+                raise ValueError("Template has no field for detailed row "
+                                 "{0}, column {1}".format(row, column))
+            field_map["detailed:{0}:{1}".format(row, column)] = by_name[name]
+
+    for logical, name in FIXED_FIELDS.items():
+        if name not in by_name:
+            raise ValueError("Template has no field {0} ({1})".format(
+                name, logical))
+        field_map[logical] = by_name[name]
+
+    return field_map
+
+
+def load_field_map(template="DDAH.pdf", template_pdf=None):
+    """
+    Return the field map of template, from the in-process cache, the
+    sidecar file, or by compiling it (and writing the sidecar).
+
+    template_pdf is the already parsed template, if the caller has it.
+    """
+    key = (os.path.abspath(template), os.path.getmtime(template))
+    field_map = _CACHE.get(key)
+    if field_map is not None:
+        return field_map
+
+    digest = template_hash(template)
+    path = sidecar_path(template)
+    try:
+        with open(path) as f:
+            sidecar = json.load(f)
+        if (sidecar.get("version") == FIELD_MAP_VERSION and
+                sidecar.get("template_sha256") == digest):
+            field_map = sidecar["fields"]
+    except (IOError, ValueError):
+        pass
+
+    if field_map is None:
+        if template_pdf is None:
+            template_pdf = load_template(template).template
+        field_map = compile_field_map(template_pdf)
+        sidecar = {"version": FIELD_MAP_VERSION,
+                   "template_sha256": digest,
+                   "fields": field_map}
+        # Write a temporary file and rename it, so that a process starting
+        # meanwhile never reads half a sidecar
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            try:
+                with open(temp_path, "w") as f:
+                    json.dump(sidecar, f, indent=1, sort_keys=True)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        except (IOError, OSError):
+            # The sidecar is only a cache; a read-only directory is fine
+            pass
+
+    _CACHE[key] = field_map
+    return field_map
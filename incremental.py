@@ -0,0 +1,338 @@
+"""
+Write filled forms as incremental updates of the template.
+
+Filling a form changes a few dozen objects of DDAH.pdf (the annotations
+of the filled fields, their appearance streams), yet PdfWriter writes all
+of the template's objects again for every TA. write_incremental instead
+copies the template file as it is and appends an incremental update
+(PDF 1.7, section 7.5.6) holding only the objects that differ from the
+template, under their original object numbers, plus the new objects
+(such as appearance streams) under new numbers, and a cross-reference
+stream whose /Prev points at the template's last one.
+
+The template's bytes, including any signature, stay intact at the start of
+every form, so auditors can check that it was not altered.
+
+Sample Usage:
+
+    from incremental import write_incremental
+    write_incremental("out.pdf", fill_pdf(ta_data), "DDAH.pdf")
+"""
+import hashlib
+import os
+import re
+import zlib
+
+from pdfrw import PdfArray, PdfDict, PdfName, PdfWriter
+
+from compact import XREF_WIDTHS, format_scalar, is_indirect
+from template_cache import load_template
+
+# Template files and their object numbers, keyed by (absolute path,
+# modification time)
+_BASES = {}
+
+_STARTXREF = re.compile(br"startxref\s+(\d+)\s+%%EOF\s*$")
+
+
+def _number(obj):
+    """
+    Return the (object number, generation) obj had in the file it was
+    read from, or None.
+    """
+    indirect = getattr(obj, "indirect", None)
+    if isinstance(indirect, tuple):
+        return indirect
+    return None
+
+
+class TemplateBase(object):
+    """
+    The bytes of a template file and its objects by object number.
+    """
+
+    def __init__(self, template="DDAH.pdf"):
+        with open(template, "rb") as f:
+            self.data = f.read()
+        match = _STARTXREF.search(self.data[-1024:])
+        if match is None:
+            raise ValueError("{0} has no startxref".format(template))
+        self.startxref = int(match.group(1))
+
+        trailer = load_template(template).template
+        self.trailer = trailer
+        self.objects = {}
+        seen = set()
+        stack = [trailer]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            number = _number(obj)
+            if number is not None:
+                self.objects[number[0]] = obj
+            if isinstance(obj, PdfDict):
+                stack.extend(value for key, value in obj.iteritems())
+            elif isinstance(obj, PdfArray):
+                stack.extend(obj)
+        self.size = max([int(trailer.Size or 0)] +
+                        [number + 1 for number in self.objects])
+
+    def original(self, obj):
+        """
+        Return the template object that obj is (or is a copy of, see
+        TemplateCache), or None for objects that are not in the template.
+        """
+        number = _number(obj)
+        if number is None:
+            return None
+        original = self.objects.get(number[0])
+        # Copies share the indirect tuple of the object they were copied
+        # from; objects of other files (e.g. overlay pages) do not
+        if original is None or original.indirect is not obj.indirect:
+            return None
+        return original
+
+
+def load_base(template="DDAH.pdf"):
+    """
+    Return the TemplateBase of template, reading it only the first time
+    it is requested (or after it changes on disk).
+    """
+    path = os.path.abspath(template)
+    key = (path, os.path.getmtime(path))
+    base = _BASES.get(key)
+    if base is None:
+        base = _BASES[key] = TemplateBase(template)
+    return base
+
+
+class _Update(object):
+    """
+    Collect the objects of a filled form that an incremental update of
+    its template has to write.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.next_number = base.size
+        self.numbers = {}    # id(obj) -> (object number, generation)
+        self.pending = []
+        self.written = []    # [((number, generation), obj, body)]
+
+    def ref(self, obj):
+        """
+        Return the "n g R" reference to the indirect object obj, queueing
+        it for a look the first time.
+        """
+        number = self.numbers.get(id(obj))
+        if number is None:
+            original = self.base.original(obj)
+            if original is not None:
+                number = _number(obj)
+                # Template objects themselves never changed
+                if original is not obj:
+                    self.pending.append((number, obj, original))
+            else:
+                number = (self.next_number, 0)
+                self.next_number += 1
+                self.pending.append((number, obj, None))
+            self.numbers[id(obj)] = number
+        return "%d %d R" % number
+
+    def format(self, obj, parts):
+        if isinstance(obj, PdfDict):
+            parts.append("<<")
+            for key, value in obj.iteritems():
+                if obj.stream is not None and key == PdfName.Length:
+                    continue
+                parts.append(str(key))
+                self.value(value, parts)
+            if obj.stream is not None:
+                parts.append("/Length %d" % len(obj.stream))
+            parts.append(">>")
+        elif isinstance(obj, PdfArray):
+            parts.append("[")
+            for value in obj:
+                self.value(value, parts)
+            parts.append("]")
+        else:
+            parts.append(format_scalar(obj))
+
+    def value(self, obj, parts):
+        if is_indirect(obj):
+            parts.append(self.ref(obj))
+        else:
+            self.format(obj, parts)
+
+    def same(self, a, b):
+        """
+        Return whether a, a value in a copied object, would be written the
+        same way as b, the value in the template at the same place.
+        Indirect objects are compared by reference and queued for their
+        own look.
+        """
+        if a is b:
+            # Template objects never change
+            return True
+        if is_indirect(a):
+            self.ref(a)
+            number = _number(a)
+            return number is not None and number is _number(b)
+        return self.same_contents(a, b)
+
+    def same_contents(self, a, b):
+        # The template and its copies are fully resolved, so the raw dict
+        # and list methods are enough (and much faster than pdfrw's)
+        if isinstance(a, PdfDict):
+            if (not isinstance(b, PdfDict) or a.stream != b.stream or
+                    len(a) != len(b)):
+                return False
+            for key, value in dict.items(a):
+                other = dict.get(b, key)
+                if other is None or not self.same(value, other):
+                    return False
+            return True
+        if isinstance(a, PdfArray):
+            if not isinstance(b, PdfArray) or len(a) != len(b):
+                return False
+            for x, y in zip(list.__iter__(a), list.__iter__(b)):
+                if not self.same(x, y):
+                    return False
+            return True
+        return type(a) is type(b) and a == b
+
+    def collect(self, trailer):
+        """
+        Find the changed and new objects reachable from trailer. Returns
+        the formatted /Root and /Info references.
+        """
+        kept = []
+        for key in (PdfName.Root, PdfName.Info):
+            if trailer[key] is not None:
+                kept.append("%s %s" % (key, self.ref(trailer[key])))
+        while self.pending:
+            number, obj, original = self.pending.pop()
+            # Comparing an unchanged copy also queues the objects it
+            # refers to, which may have changed
+            if original is not None and self.same_contents(obj, original):
+                continue
+            parts = []
+            self.format(obj, parts)
+            self.written.append((number, obj, " ".join(parts)))
+        self.written.sort(key=lambda entry: entry[0])
+        return kept
+
+
+def _sections(numbers):
+    """
+    Group sorted object numbers into [first, count] runs for /Index.
+    """
+    index = []
+    for number in numbers:
+        if index and index[-2] + index[-1] == number:
+            index[-1] += 1
+        else:
+            index.extend([number, 1])
+    return index
+
+
+def write_incremental(outfile, document, template="DDAH.pdf"):
+    """
+    Write document (a filled copy of template, see fill_pdf) to outfile
+    (a path or a binary file object) as template followed by an
+    incremental update. Returns the number of bytes written.
+    """
+    if isinstance(document, PdfWriter):
+        raise ValueError("Incremental updates need a filled template, "
+                         "not a PdfWriter")
+    base = load_base(template)
+    update = _Update(base)
+    trailer_parts = update.collect(document)
+
+    chunks = [base.data]
+    offset = len(base.data)
+    if not base.data.endswith(b"\n"):
+        chunks.append(b"\n")
+        offset += 1
+
+    xref = {}
+
+    def add_object(number, generation, body, stream=None):
+        nonlocal offset
+        text = "%d %d obj\n%s\n" % (number, generation, body)
+        if stream is not None:
+            text += "stream\n%s\nendstream\n" % stream
+        text += "endobj\n"
+        data = text.encode("latin-1")
+        xref[number] = (1, offset, generation)
+        chunks.append(data)
+        offset += len(data)
+
+    # Streams are written as they are; the other objects go into one
+    # compressed object stream. Besides being smaller, this lets readers
+    # that load object streams eagerly (such as pdfrw) see the new
+    # versions of objects that the template keeps in object streams.
+    packed = []
+    for (number, generation), obj, body in update.written:
+        if obj.stream is not None or generation != 0:
+            add_object(number, generation, body, obj.stream)
+        else:
+            packed.append((number, body))
+    xref_number = update.next_number
+    if packed:
+        stream_number = xref_number
+        xref_number += 1
+        header = []
+        position = 0
+        for index, (number, body) in enumerate(packed):
+            header.append("%d %d" % (number, position))
+            position += len(body) + 1
+            xref[number] = (2, stream_number, index)
+        header = " ".join(header) + "\n"
+        data = zlib.compress((header + "\n".join(body for number, body
+                                                in packed) + "\n")
+                             .encode("latin-1"))
+        add_object(stream_number, 0,
+                   "<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode"
+                   " /Length %d >>" % (len(packed), len(header), len(data)),
+                   data.decode("latin-1"))
+
+    # The first ID stays the template's; the second identifies this
+    # version of the file
+    digest = hashlib.md5(b"".join(chunks[1:])).hexdigest().upper()
+    id_parts = ""
+    if base.trailer.ID is not None:
+        id_parts = " /ID [%s <%s>]" % (format_scalar(base.trailer.ID[0]),
+                                        digest)
+
+    xref[xref_number] = (1, offset, 0)
+    numbers = sorted(xref)
+    rows = []
+    for number in numbers:
+        kind, field2, field3 = xref[number]
+        rows.append(kind.to_bytes(XREF_WIDTHS[0], "big") +
+                    field2.to_bytes(XREF_WIDTHS[1], "big") +
+                    field3.to_bytes(XREF_WIDTHS[2], "big"))
+    data = zlib.compress(b"".join(rows))
+    dictionary = ("<< /Type /XRef /Size %d /Index [%s] /W [%d %d %d]"
+                  " /Prev %d %s%s /Filter /FlateDecode /Length %d >>" % (
+                      (xref_number + 1,
+                       " ".join(str(n) for n in _sections(numbers))) +
+                      XREF_WIDTHS +
+                      (base.startxref, " ".join(trailer_parts), id_parts,
+                       len(data))))
+    chunks.append(("%d 0 obj\n%s\nstream\n" % (xref_number, dictionary))
+                  .encode("latin-1"))
+    chunks.append(data)
+    chunks.append(("\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % offset)
+                  .encode("latin-1"))
+
+    written = b"".join(chunks)
+    if hasattr(outfile, "write"):
+        outfile.write(written)
+    else:
+        with open(outfile, "wb") as f:
+            f.write(written)
+    return len(written)
@@ -0,0 +1,80 @@
+"""
+Build manifest for incremental batch runs.
+
+The manifest is a JSON file that records, for every generated PDF, a hash
+of everything that went into it: the TA data file, the effective
+INFO_FIELDS/APPROVER/DATE values, the template and the engine. A rerun
+only regenerates the PDFs whose hash changed (or that are missing) and
+reports the rest as up to date.
+"""
+import hashlib
+import json
+import os
+
+# Bump to invalidate every manifest entry, e.g. when the fill logic changes
+MANIFEST_VERSION = 2
+
+
+def file_hash(filename):
+    """
+    Return the SHA-256 hex digest of the contents of filename.
+    """
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_key(data_file, engine, template_digest, info_fields, approver,
+              date):
+    """
+    Return the hash identifying one generated form: the content of
+    data_file plus everything else that ends up in the PDF.
+    """
+    inputs = {"version": MANIFEST_VERSION,
+              "data": file_hash(data_file),
+              "engine": engine,
+              "template": template_digest,
+              "info_fields": info_fields,
+              "approver": approver,
+              "date": date}
+    encoded = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Manifest(object):
+    """
+    The set of generated PDFs and the input hash each was built from.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.entries = manifest["entries"]
+
+    def is_up_to_date(self, pdf_out_file, key):
+        """
+        True if pdf_out_file exists and was built from inputs hashing to key.
+        """
+        entry = self.entries.get(pdf_out_file)
+        return (entry is not None and entry["key"] == key and
+                os.path.exists(pdf_out_file))
+
+    def record(self, pdf_out_file, data_file, key):
+        self.entries[pdf_out_file] = {"key": key, "source": data_file}
+
+    def forget(self, pdf_out_file):
+        self.entries.pop(pdf_out_file, None)
+
+    def save(self):
+        """
+        Write the manifest, replacing the old file only once the new one
+        is complete.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
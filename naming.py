@@ -0,0 +1,82 @@
+"""
+Names of the files and archive entries that generated forms are written
+to.
+
+Plain Python (os and re only), so that archive.py and the other writers
+can share these without loading pdfrw or the fill engines.
+"""
+import os
+import re
+
+
+def output_path(data_file, outdir=None, extension=".pdf"):
+    """
+    Return the PDF path (or the path with another extension) for
+    data_file: next to it, or inside outdir.
+    """
+    pdf_out_file = os.path.splitext(data_file)[0] + extension
+    if outdir is not None:
+        pdf_out_file = os.path.join(outdir, os.path.basename(pdf_out_file))
+    return pdf_out_file
+
+
+def check_output_paths(data_files, outdir=None, extension=".pdf"):
+    """
+    Raise ValueError if two different files of data_files would be written
+    to the same output_path, e.g. a/ta.txt and b/ta.txt with the same
+    outdir.
+    """
+    sources = {}
+    collisions = []
+    for data_file in data_files:
+        out_file = output_path(data_file, outdir, extension)
+        source = os.path.realpath(data_file)
+        other = sources.setdefault(
+            os.path.normcase(os.path.abspath(out_file)), source)
+        if other != source:
+            collisions.append("{0} and {1} -> {2}".format(other, source,
+                                                          out_file))
+    if collisions:
+        raise ValueError("Files would overwrite each other's output (use "
+                         "separate runs or --archive):\n  " +
+                         "\n  ".join(collisions))
+
+
+def file_name(name):
+    """
+    Turn a TA or course name into a safe file name.
+    """
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", str(name)).strip("_.") or "TA"
+
+
+def unique_name(stem, used):
+    """
+    Return stem, or stem_2, stem_3, ... if it is already in the dict used,
+    and add the name returned to used.
+
+    used maps each name returned so far to the last number tried for it,
+    so a name that keeps coming back does not rescan its earlier numbers.
+    It holds one short entry per name returned: its memory grows with the
+    number of forms (O(unique names)), not with their size.
+    """
+    if stem not in used:
+        used[stem] = 1
+        return stem
+    number = used[stem]
+    name = stem
+    while name in used:
+        number += 1
+        name = "{0}_{1}".format(stem, number)
+    used[stem] = number
+    used[name] = 1
+    return name
+
+
+def ta_output_path(directory, name, used):
+    """
+    Return the PDF path for the TA called name inside directory, numbered
+    (name_2.pdf, ...) if the name is already in the dict used (see
+    unique_name), and add it to used.
+    """
+    return os.path.join(directory,
+                        unique_name(file_name(name), used) + ".pdf")
@@ -0,0 +1,354 @@
+"""
+Generate the DDAH forms of very large rosters in bounded memory.
+
+Sample Usage:
+
+    python pipeline.py -o out/ faculty_roster.txt
+    python pipeline.py -j 4 --incremental -o out/ rosters/
+    python pipeline.py --archive - rosters/ | ssh host "cat > forms.zip"
+
+The sources are roster files in the format of sample_data.txt (one or
+many TAs per file, see roster.iter_blocks) or directories of them. Every
+step works on one TA at a time and hands it to the next through a bounded
+queue:
+
+    read       a reader thread splits the rosters into TAs
+    validate   a thread parses and checks each TA (roster.parse_lines)
+    fill       worker processes fill the form ...
+    serialize  ... and serialize it to PDF bytes (see engines.Engine)
+    write      a writer thread saves the bytes to OUTDIR/<TA name>.pdf, or
+               adds them to an archive as <course code>/<TA name>.pdf
+               (see archive.py; "-" streams it to stdout)
+
+When a step falls behind, the queue in front of it fills up and the steps
+before it wait (backpressure), so no more than about 3 * QUEUE_SIZE TAs
+are in flight at any time, however large the rosters are. The only state
+that grows with the roster is one short entry per form, to number TAs
+with the same name (see naming.unique_name). Reading and writing the files
+overlaps with the filling. Forms are written in the order they are
+finished, not in roster order.
+
+If a step fails unexpectedly, it sets a stop flag that every other step
+checks while waiting on a queue, so the run ends (and the error is
+raised) instead of waiting forever for a step that is gone.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+
+from archive import ArchiveWriter, guess_format
+from batch import find_data_files
+from naming import ta_output_path
+from compact import DEFAULT_LEVEL
+from convert import INFO_FIELDS
+from engines import (PDF_ENGINES as ENGINES, choose_engine, format_report,
+                     get_engine, resolve_engine)
+from roster import RosterError, iter_blocks, parse_lines
+
+# TAs held by each queue between two steps
+QUEUE_SIZE = 32
+
+# Marks the end of a queue
+_DONE = None
+
+# Seconds between two checks of the stop flag while waiting on a queue
+POLL_INTERVAL = 0.1
+
+# Per-process state, set up by _init_worker
+_WORKER = {}
+
+
+def _init_worker(engine, template, flatten=False, compact=None,
+                 incremental=False):
+    _WORKER["engine"] = get_engine(engine, template, flatten, compact,
+                                   incremental)
+    # Parse the template now, once per worker. run_pipeline checked it
+    # already (see engines.load_engine); if it still fails, every job
+    # reports the error, since a Pool initializer that raises never stops.
+    try:
+        _WORKER["engine"].load()
+    except Exception:
+        pass
+
+
+def _render(job):
+    """
+    Fill and serialize the form of one TA. Returns (source, PDF path or
+    TA name, PDF bytes, error), where the bytes are None if error is not.
+    """
+    source, pdf_out_file, ta_data = job
+    try:
+        data = _WORKER["engine"].render(ta_data)
+    except Exception as e:
+        return source, pdf_out_file, None, "{0}: {1}".format(
+            type(e).__name__, e)
+    return source, pdf_out_file, data, None
+
+
+def _drain(inbox, stop):
+    """
+    Yield the items of inbox until its end marker, or until the event stop
+    is set.
+    """
+    while True:
+        try:
+            item = inbox.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def _put(outbox, item, stop):
+    """
+    Put item into outbox, waiting for room unless the event stop is set.
+    Returns whether the item was put.
+    """
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _start(target, stop, crashed):
+    """
+    Run target in a thread. If it raises, the exception is appended to
+    crashed and stop is set.
+    """
+    def run():
+        try:
+            target()
+        except BaseException as e:
+            crashed.append(e)
+            stop.set()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def run_pipeline(sources, outdir=".", engine="acroform", workers=None,
+                 template="DDAH.pdf", flatten=False, compact=None,
+                 incremental=False, queue_size=QUEUE_SIZE, archive=None,
+                 archive_format=None):
+    """
+    Generate the form of every TA in the roster files sources (or
+    directories of them) into outdir, holding at most about
+    3 * queue_size TAs in memory. If archive is given (a path, "-" for
+    stdout, or a binary file object), the forms are written into that ZIP
+    or tar archive instead (see archive.ArchiveWriter).
+
+    Returns a summary dict with the number of forms "written" and the list
+    of "failed" (source, error message) pairs. Only the count of written
+    forms is kept, so the summary does not grow with the roster.
+
+    Raises ValueError before starting anything if the template cannot be
+    loaded.
+    """
+    if engine not in ENGINES and engine != "auto":
+        raise ValueError("Unknown engine {0}, expected one of {1}".format(
+            engine, ", ".join(sorted(ENGINES) + ["auto"])))
+    if flatten and engine not in ("acroform", "auto"):
+        raise ValueError("Only the acroform engine can flatten forms")
+    if compact is not None and incremental:
+        raise ValueError("Forms cannot be both compact and incremental")
+    engine = resolve_engine(engine, template, flatten, compact, incremental)
+    if archive is not None:
+        writer = ArchiveWriter(archive, archive_format)
+        course_code = INFO_FIELDS.get("Course Code")
+    elif not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    failed = []
+    written = [0]
+    stop = threading.Event()
+    crashed = []
+    blocks = queue.Queue(queue_size)
+    records = queue.Queue(queue_size)
+    outputs = queue.Queue(queue_size)
+
+    def read():
+        try:
+            for source in find_data_files(sources):
+                try:
+                    for block in iter_blocks(source):
+                        if not _put(blocks, (source, block), stop):
+                            return
+                except (IOError, UnicodeDecodeError) as e:
+                    failed.append((source, str(e)))
+        finally:
+            _put(blocks, _DONE, stop)
+
+    def validate():
+        used = {}
+        try:
+            for source, block in _drain(blocks, stop):
+                try:
+                    ta_data = parse_lines(block, source)
+                except RosterError as e:
+                    failed.append((source, str(e)))
+                    continue
+                if archive is not None:
+                    # Named by the writer, in the order they are finished
+                    target = ta_data["name"]
+                else:
+                    target = ta_output_path(outdir, ta_data["name"], used)
+                if not _put(records, (source, target, ta_data), stop):
+                    return
+        finally:
+            _put(records, _DONE, stop)
+
+    def write():
+        for source, target, data, error in _drain(outputs, stop):
+            if error is None:
+                try:
+                    if archive is not None:
+                        writer.write(writer.entry_name(target, course_code),
+                                     data)
+                    else:
+                        with open(target, "wb") as f:
+                            f.write(data)
+                    written[0] += 1
+                    continue
+                except IOError as e:
+                    error = str(e)
+            failed.append((source, error))
+
+    threads = [_start(read, stop, crashed), _start(validate, stop, crashed),
+               _start(write, stop, crashed)]
+
+    workers = workers or os.cpu_count() or 1
+    options = (engine, template, flatten, compact, incremental)
+    try:
+        if workers == 1:
+            _init_worker(*options)
+            for job in _drain(records, stop):
+                if not _put(outputs, _render(job), stop):
+                    break
+        else:
+            # Pool.imap reads its input as fast as it can, so the jobs in
+            # flight are limited by hand: one slot per job, given back
+            # once its result is taken
+            slots = threading.BoundedSemaphore(queue_size)
+
+            def jobs():
+                for job in _drain(records, stop):
+                    while not slots.acquire(timeout=POLL_INTERVAL):
+                        if stop.is_set():
+                            return
+                    yield job
+
+            pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                        initargs=options)
+            try:
+                for result in pool.imap_unordered(_render, jobs()):
+                    slots.release()
+                    if not _put(outputs, result, stop):
+                        break
+            finally:
+                if stop.is_set():
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _put(outputs, _DONE, stop)
+        for thread in threads:
+            thread.join()
+        if archive is not None:
+            writer.close()
+    if crashed:
+        raise crashed[0]
+
+    return {"written": written[0], "failed": failed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate the DDAH forms of very large rosters in "
+                    "bounded memory.")
+    parser.add_argument("sources", nargs="+",
+                        help="roster files, directories or glob patterns")
+    parser.add_argument("-o", "--outdir", default=".",
+                        help="write OUTDIR/<TA name>.pdf")
+    parser.add_argument("--archive", metavar="FILE",
+                        help="write the forms into this ZIP or tar archive "
+                             "instead, or to stdout if FILE is -")
+    parser.add_argument("--archive-format", choices=("zip", "tar", "tar.gz"),
+                        help="archive format (default: from the FILE "
+                             "extension, zip for stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="TAs held between two steps (default: {0})"
+                             .format(QUEUE_SIZE))
+    parser.add_argument("--flatten", action="store_true",
+                        help="turn the form fields into static content")
+    parser.add_argument("--compact", metavar="LEVEL", type=int, nargs="?",
+                        const=DEFAULT_LEVEL, choices=range(10),
+                        help="write compressed object streams")
+    parser.add_argument("--incremental", action="store_true",
+                        help="append the filled fields to an unchanged "
+                             "copy of the template")
+    parser.add_argument("--engine", choices=sorted(ENGINES) + ["auto"],
+                        default="acroform",
+                        help="fill engine; auto picks the fastest correct "
+                             "one for the template (see engines.py)")
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+    if args.flatten and args.engine not in ("acroform", "auto"):
+        parser.error("--flatten only works with the acroform engine")
+    if args.incremental and args.compact is not None:
+        parser.error("--incremental cannot be used with --compact")
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    if args.archive and args.archive_format is None and args.archive != "-":
+        if guess_format(args.archive) is None:
+            parser.error("cannot tell the archive format of {0}, use "
+                         "--archive-format".format(args.archive))
+
+    # Keep stdout for the archive
+    out = sys.stderr if args.archive == "-" else sys.stdout
+    if args.engine == "auto":
+        try:
+            args.engine, report = choose_engine(
+                args.template, args.flatten, args.compact, args.incremental)
+        except ValueError as e:
+            parser.error(str(e))
+        for line in format_report(report, args.engine):
+            print(line, file=out)
+
+    try:
+        summary = run_pipeline(args.sources, args.outdir, args.engine,
+                               args.workers, args.template, args.flatten,
+                               args.compact, args.incremental,
+                               args.queue_size, args.archive,
+                               args.archive_format)
+    except ValueError as e:
+        # Raised before any thread or worker starts, e.g. for a template
+        # that cannot be loaded
+        parser.error(str(e))
+
+    print("{0} forms written, {1} failed".format(summary["written"],
+                                                len(summary["failed"])),
+          file=out)
+    for source, error in summary["failed"]:
+        print("  {0}: {1}".format(source, error), file=out)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
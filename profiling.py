@@ -0,0 +1,161 @@
+"""
+Per-stage timing and allocation hooks for form generation.
+
+The fill code wraps its expensive steps in stage(name):
+
+    template_parse   PdfReader parsing the template (once per process)
+    course_fields    filling the fields shared by a course (once per course)
+    template_clone   copying the template for one TA
+    parse_data       reading a TA data file
+    fill_fields      setting the AcroForm field values
+    overlay_render   reportlab rendering in generate_page1/generate_page2
+    page_merge       PageMerge(...).render()
+    pdf_write        PdfWriter().write
+
+Every finished stage is reported to the callbacks registered with
+add_callback() as an event dict: stage name, TA (see ta()), start time
+and duration in seconds, and the net number of memory blocks allocated
+during the stage. Without callbacks, stage() costs next to nothing.
+
+Recorder is a callback that keeps the events and writes them as JSON (with
+per-stage totals) or as a Chrome trace for chrome://tracing or Perfetto.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+_callbacks = []
+_local = threading.local()
+
+
+def add_callback(callback):
+    """
+    Call callback(event) for every stage that finishes from now on.
+    """
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    _callbacks.remove(callback)
+
+
+def clear_callbacks():
+    del _callbacks[:]
+
+
+def enabled():
+    """
+    True if any callback is registered, i.e. stages are being measured.
+    """
+    return bool(_callbacks)
+
+
+def report(event):
+    """
+    Pass an event to the callbacks, e.g. one recorded in a worker process.
+    """
+    for callback in list(_callbacks):
+        callback(event)
+
+
+def current_ta():
+    return getattr(_local, "ta", None)
+
+
+@contextlib.contextmanager
+def ta(label):
+    """
+    Attribute the stages run inside this block to the TA label (e.g. its
+    data file).
+    """
+    previous = current_ta()
+    _local.ta = label
+    try:
+        yield
+    finally:
+        _local.ta = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time the block as stage name and report it to the callbacks.
+    """
+    if not _callbacks:
+        yield
+        return
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        event = {"stage": name,
+                 "ta": current_ta(),
+                 "start": start,
+                 "duration": duration,
+                 "allocated_blocks": sys.getallocatedblocks() - blocks,
+                 "pid": os.getpid(),
+                 "tid": threading.get_ident()}
+        report(event)
+
+
+class Recorder(object):
+    """
+    A callback that collects stage events.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def drain(self):
+        """
+        Return the events collected so far and forget them.
+        """
+        events, self.events = self.events, []
+        return events
+
+    def stage_totals(self):
+        """
+        Return {stage: {"count", "total_s", "mean_s", "allocated_blocks"}}.
+        """
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event["stage"], {
+                "count": 0, "total_s": 0.0, "allocated_blocks": 0})
+            total["count"] += 1
+            total["total_s"] += event["duration"]
+            total["allocated_blocks"] += event["allocated_blocks"]
+        for total in totals.values():
+            total["mean_s"] = total["total_s"] / total["count"]
+        return totals
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"stages": self.stage_totals(), "events": self.events},
+                      f, indent=1)
+
+    def write_chrome_trace(self, path):
+        """
+        Write the events in the Chrome trace event format.
+        """
+        trace = []
+        for event in self.events:
+            trace.append({"name": event["stage"],
+                          "cat": "ddah",
+                          "ph": "X",
+                          "ts": event["start"] * 1e6,
+                          "dur": event["duration"] * 1e6,
+                          "pid": event["pid"],
+                          "tid": event["tid"],
+                          "args": {"ta": event["ta"],
+                                   "allocated_blocks":
+                                       event["allocated_blocks"]}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
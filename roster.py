@@ -0,0 +1,191 @@
+"""
+Read and check TA data, without any PDF library.
+
+TA data comes in the format of sample_data.txt, one TA per file or many
+TAs per roster file (see iter_blocks). Everything here is plain Python, so
+checking thousands of files (see validate.py) does not pay for loading
+pdfrw and the template. convert.py re-exports these names.
+"""
+import glob
+import os
+
+# The values below are the order in wich these categories appear in
+# page 2 of the DDAH forms
+DDAH_CATEGORIES = {"CONTACT HOURS" : 3,
+                   "MARKING HOURS": 4,
+                   "PREP HOURS": 2,
+                   "INVIGILATION HOURS": 5}
+
+# The valeus below are the category names in the page 1 of the DDAH forms
+DDAH_CATEGORY_NAMES = {"CONTACT HOURS" : "Contact Time",
+                       "MARKING HOURS": "Marking/Grading",
+                       "PREP HOURS": "Preparation",
+                       "INVIGILATION HOURS": "Other Duties"}
+
+
+class RosterError(ValueError):
+    """
+    A problem in TA data, located by file name and line number.
+    """
+    def __init__(self, message, filename=None, lineno=None):
+        self.message = message
+        self.filename = filename
+        self.lineno = lineno
+        if filename is not None and lineno is not None:
+            message = "{0}:{1}: {2}".format(filename, lineno, message)
+        elif filename is not None:
+            message = "{0}: {1}".format(filename, message)
+        ValueError.__init__(self, message)
+
+def parse_lines(lines, filename=None, errors=None):
+    """
+    Parse one TA from lines, an iterable of (line number, line) pairs in
+    the format of sample_data.txt. Errors are raised as RosterError,
+    unless errors is a list: then every problem of the TA is appended to
+    it and None is returned if there was any.
+    """
+    problems = []
+
+    def problem(message, lineno):
+        error = RosterError(message, filename, lineno)
+        if errors is None:
+            raise error
+        problems.append(error)
+
+    ta = {
+        "name": "",     # TA full name
+        "total": 0,     # total contract hours
+        "detailed": [], # materials for the first page
+        "summary": {}   # materials for the second page
+    }
+    category = None
+    total_hours = 0
+    total_lineno = None
+    row_linenos = []
+
+    for lineno, line in lines:
+        line = line.strip()
+        if not line or line.startswith("====") or line.startswith("TA INFO"):
+            # skip these lines. they are not meaningful
+            continue
+
+        try:
+            key, info = line.split(":")
+        except ValueError:
+            problem("Expected 'key: value', got {0!r}".format(line), lineno)
+            continue
+        key = key.strip()
+
+        if key in DDAH_CATEGORIES:
+            category = key
+
+        try:
+            if key.lower().startswith("full name"):
+                ta["name"] = info.strip()
+            elif key.startswith("Total contract"):
+                ta["total"] = float(info.strip().strip("_").strip())
+                total_lineno = lineno
+            else:
+                # convert info -> hours, filter out zero hours:
+                info = info.strip().strip("_").strip()
+                if not info:
+                    continue
+                hours = float(info)
+                if hours < 0.1:
+                    continue
+
+                # detailed hours:
+                ta["detailed"].append((key, category, hours),)
+                row_linenos.append(lineno)
+                # summary hours:
+                if category is None:
+                    problem("{0} is not under a category heading such as "
+                            "CONTACT HOURS".format(key), lineno)
+                    continue
+                if category not in ta["summary"]:
+                    ta["summary"][category] = 0
+                ta["summary"][category] += hours
+                # total hours:
+                total_hours += hours
+        except RosterError:
+            raise
+        except ValueError:
+            problem("{0} is not a number".format(info.strip()), lineno)
+
+    # verify that the hours add up (unless some hours could not be read)
+    if not problems and total_hours != ta["total"]:
+        problem("Total contract hours is {0} but {1} hours are assigned".format(ta["total"], total_hours),
+                total_lineno)
+    # verify that there are at most 12 rows in ta["detailed"]
+    if len(ta["detailed"]) > 12:
+        problem("DDAH form supports at most 12 rows of detailed activity, but there are {0}".format(len(ta["detailed"])),
+                row_linenos[12])
+
+    if problems:
+        errors.extend(problems)
+        return None
+    return ta
+
+def parse_data(filename):
+    """
+    Parse data in filename. See sample_data.txt for an example.
+    """
+    with open(filename) as f:
+        return parse_lines(enumerate(f, 1), filename)
+
+def _has_content(block):
+    for lineno, line in block:
+        line = line.strip()
+        if line and not line.startswith("TA INFO"):
+            return True
+    return False
+
+def iter_blocks(filename):
+    """
+    Split a roster file holding many TAs, each in the format of
+    sample_data.txt and separated by "====" lines (or starting with a
+    "TA INFO" line), into the (line number, line) pairs of each TA, one TA
+    at a time. Only one TA's lines are held in memory.
+    """
+    with open(filename) as f:
+        block = []
+        for lineno, line in enumerate(f, 1):
+            stripped = line.strip()
+            starts_ta = stripped.startswith("TA INFO") and _has_content(block)
+            if stripped.startswith("====") or starts_ta:
+                if _has_content(block):
+                    yield block
+                block = []
+            if not stripped.startswith("===="):
+                block.append((lineno, line))
+        if _has_content(block):
+            yield block
+
+def iter_roster(filename, errors=None):
+    """
+    Parse a roster file holding many TAs (see iter_blocks) and yield one
+    TA at a time.
+
+    Invalid TAs raise a RosterError, unless errors is a list, in which
+    case their errors are appended to it and parsing continues with the
+    next TA.
+    """
+    for block in iter_blocks(filename):
+        ta = parse_lines(block, filename, errors)
+        if ta is not None:
+            yield ta
+
+def find_data_files(paths):
+    """
+    Expand directories and glob patterns in paths into a sorted list of
+    TA data files.
+    """
+    data_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            data_files.extend(glob.glob(os.path.join(path, "*.txt")))
+        elif glob.has_magic(path):
+            data_files.extend(glob.glob(path))
+        else:
+            data_files.append(path)
+    return sorted(set(data_files))
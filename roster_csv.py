@@ -0,0 +1,254 @@
+"""
+Load TA rosters from CSV/TSV spreadsheets with one row per TA.
+
+The first row holds the column names: "Full Name", "Total contract hours"
+and one column per activity, named as in sample_data.txt (for example
+"Lab/tutorial hours" or "Exam marking hours"). Activities that are not in
+ACTIVITY_CATEGORIES can name their category explicitly, as in
+"PREP HOURS: Reading week prep".
+
+The roster is held column by column in numpy arrays and all of the checks
+parse_data does for a single TA (total hours match, dropping hours < 0.1,
+at most 12 detailed rows, per-category sums) run on every row at once.
+
+Requires numpy.
+"""
+import csv
+import os
+
+from roster import DDAH_CATEGORIES, RosterError
+
+# Activity column -> category, for the activities in sample_data.txt
+ACTIVITY_CATEGORIES = {"Lab/tutorial hours": "CONTACT HOURS",
+                       "In-lecture support hours": "CONTACT HOURS",
+                       "Office hours": "CONTACT HOURS",
+                       "Test/quiz marking hours": "MARKING HOURS",
+                       "Exam marking hours": "MARKING HOURS",
+                       "Midterm marking hours": "MARKING HOURS",
+                       "Assignment marking hours": "MARKING HOURS",
+                       "Lab/tutorial prep hours": "PREP HOURS",
+                       "Office hours prep hours": "PREP HOURS",
+                       "Meetings with instructors": "PREP HOURS",
+                       "Midterm invigilation": "INVIGILATION HOURS",
+                       "Exam invigilation": "INVIGILATION HOURS"}
+
+def _column_category(column):
+    """
+    Return (activity, category) for an activity column name.
+    """
+    if column in ACTIVITY_CATEGORIES:
+        return column, ACTIVITY_CATEGORIES[column]
+    category, _, activity = column.partition(":")
+    if activity and category.strip() in DDAH_CATEGORIES:
+        return activity.strip(), category.strip()
+    return None, None
+
+
+def _to_floats(np, values, name, filename, linenos, unreadable):
+    """
+    Convert a column of strings to a float array; blank cells (or "_"
+    placeholders) are 0. linenos holds the file line of each row.
+
+    Cells that are not numbers are 0 too: their rows are marked in the
+    boolean array unreadable, and a list of RosterError, one per such
+    cell, is returned with the floats.
+    """
+    cells = np.char.strip(np.char.strip(np.array(values, dtype=str)), "_")
+    cells = np.where(cells == "", "0", cells)
+    try:
+        return cells.astype(float), []
+    except ValueError:
+        pass
+    # Slow path, only for columns with a bad cell
+    floats = np.zeros(len(cells))
+    errors = []
+    for row, cell in enumerate(cells):
+        try:
+            floats[row] = float(cell)
+        except ValueError:
+            unreadable[row] = True
+            errors.append(RosterError("{0} is not a number ({1})".format(
+                cell, name), filename, int(linenos[row])))
+    return floats, errors
+
+
+class Roster(object):
+    """
+    A roster of TAs held as columns:
+
+        names       list of TA names
+        totals      total contract hours, one float per TA
+        hours       hours per TA (rows) and activity (columns)
+        activities  activity name of each column of hours
+        categories  DDAH category of each column of hours
+        linenos     line of the file each TA was read from
+        unreadable  boolean per TA, true if one of its cells is not a number
+        errors      RosterError for each cell that is not a number
+    """
+
+    def __init__(self, names, totals, hours, activities, categories,
+                 filename=None, linenos=None, unreadable=None, errors=()):
+        self.names = names
+        self.totals = totals
+        self.hours = hours
+        self.activities = activities
+        self.categories = categories
+        self.filename = filename
+        if linenos is None:
+            # Rows right after the header line
+            linenos = range(2, len(names) + 2)
+        self.linenos = list(linenos)
+        if unreadable is None:
+            unreadable = [False] * len(names)
+        self.unreadable = unreadable
+        self.errors = list(errors)
+
+    def __len__(self):
+        return len(self.names)
+
+    def check(self):
+        """
+        Run the parse_data checks on every TA at once. Returns a boolean
+        array of valid rows and a list of RosterError for the others, in
+        file order. TAs with a cell that is not a number are invalid, and
+        only that cell is reported for them.
+        """
+        import numpy as np
+
+        unreadable = np.asarray(self.unreadable, dtype=bool)
+
+        # filter out hours < 0.1, like parse_data does
+        assigned = self.hours >= 0.1
+        hours = np.where(assigned, self.hours, 0.0)
+
+        # Add the columns one at a time, in the order parse_data would add
+        # them, so the floating point totals match exactly.
+        total_hours = np.zeros(len(self))
+        for column in range(hours.shape[1]):
+            total_hours += hours[:, column]
+        rows = assigned.sum(axis=1)
+
+        bad_total = (total_hours != self.totals) & ~unreadable
+        too_many = (rows > 12) & ~unreadable
+
+        errors = list(self.errors)
+        for row in np.flatnonzero(bad_total | too_many):
+            lineno = self.linenos[row]
+            if bad_total[row]:
+                errors.append(RosterError(
+                    "Total contract hours is {0} but {1} hours are assigned".format(
+                        self.totals[row], total_hours[row]),
+                    self.filename, lineno))
+            if too_many[row]:
+                errors.append(RosterError(
+                    "DDAH form supports at most 12 rows of detailed activity, but there are {0}".format(
+                        rows[row]),
+                    self.filename, lineno))
+        errors.sort(key=lambda error: error.lineno)
+        return ~(bad_total | too_many | unreadable), errors
+
+    def summaries(self):
+        """
+        Return {category: array of hours per TA}, the page 2 sums.
+        """
+        import numpy as np
+
+        hours = np.where(self.hours >= 0.1, self.hours, 0.0)
+        sums = {}
+        for column, category in enumerate(self.categories):
+            if category not in sums:
+                sums[category] = np.zeros(len(self))
+            sums[category] += hours[:, column]
+        return sums
+
+    def ta_records(self, errors=None):
+        """
+        Yield the valid TAs as dicts in the format parse_data returns.
+
+        Invalid TAs raise their first RosterError, unless errors is a
+        list, in which case all errors are appended to it and only the
+        valid TAs are yielded.
+        """
+        valid, problems = self.check()
+        if problems:
+            if errors is None:
+                raise problems[0]
+            errors.extend(problems)
+        sums = self.summaries()
+        for row in range(len(self)):
+            if not valid[row]:
+                continue
+            ta = {"name": self.names[row],
+                  "total": float(self.totals[row]),
+                  "detailed": [],
+                  "summary": {}}
+            for column, hours in enumerate(self.hours[row]):
+                if hours >= 0.1:
+                    category = self.categories[column]
+                    ta["detailed"].append(
+                        (self.activities[column], category, float(hours)))
+                    ta["summary"][category] = float(sums[category][row])
+            yield ta
+
+
+def load_csv(filename, delimiter=None):
+    """
+    Load a CSV roster (or TSV, if filename ends in .tsv or delimiter is
+    a tab) into a Roster.
+    """
+    import numpy as np
+
+    if delimiter is None:
+        extension = os.path.splitext(filename)[1].lower()
+        delimiter = "\t" if extension in (".tsv", ".tab") else ","
+
+    with open(filename, newline="") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            raise RosterError("Empty roster", filename, 1)
+        header = [column.strip() for column in header]
+        columns = [[] for column in header]
+        # Blank rows are skipped, so keep the line each row came from
+        linenos = []
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            linenos.append(reader.line_num)
+            row = row + [""] * (len(header) - len(row))
+            for column, cell in zip(columns, row):
+                column.append(cell)
+
+    name_column = total_column = None
+    activities = []
+    categories = []
+    hour_columns = []
+    for index, column in enumerate(header):
+        if column.lower().startswith("full name"):
+            name_column = index
+        elif column.startswith("Total contract"):
+            total_column = index
+        else:
+            activity, category = _column_category(column)
+            if category is None:
+                raise RosterError("Unknown activity column {0!r}".format(
+                    column), filename, 1)
+            activities.append(activity)
+            categories.append(category)
+            hour_columns.append(index)
+    if name_column is None or total_column is None:
+        raise RosterError("Expected 'Full Name' and 'Total contract hours' "
+                          "columns", filename, 1)
+
+    names = [name.strip() for name in columns[name_column]]
+    unreadable = np.zeros(len(names), dtype=bool)
+    totals, errors = _to_floats(np, columns[total_column],
+                                header[total_column], filename, linenos,
+                                unreadable)
+    hours = np.zeros((len(names), len(hour_columns)))
+    for position, index in enumerate(hour_columns):
+        hours[:, position], column_errors = _to_floats(
+            np, columns[index], header[index], filename, linenos, unreadable)
+        errors.extend(column_errors)
+    return Roster(names, totals, hours, activities, categories, filename,
+                  linenos, unreadable, errors)
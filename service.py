@@ -0,0 +1,346 @@
+"""
+A long-running local service that fills DDAH forms over HTTP.
+
+Sample Usage:
+
+    python service.py --port 8338
+    python service.py --unix /tmp/ddah.sock -j 4
+
+    curl --data-binary @sample_data.txt http://localhost:8338/fill > out.pdf
+    curl --unix-socket /tmp/ddah.sock -H "Content-Type: application/json" \\
+        -d @ta.json "http://localhost/fill?engine=overlay" > out.pdf
+
+The template and the engines are loaded once, in every worker process of
+a pool, so a request only pays for filling and writing one form. Requests
+are handled by an asyncio server; the CPU-bound filling runs in the pool
+so one slow request does not hold up the others.
+
+POST /fill takes one TA, either in the format of sample_data.txt or, with
+Content-Type application/json, as
+
+    {"name": "Jane Doe", "total": 60,
+     "detailed": [["Office hours", "CONTACT HOURS", 20], ...]}
+
+and answers with the filled PDF. Invalid TA data gets a 400 response with
+the error message. GET /health answers "ok" once the workers are ready.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import urllib.parse
+
+from engines import PDF_ENGINES as ENGINES, get_engine, resolve_engine
+from roster import DDAH_CATEGORIES, parse_lines
+
+# Largest request body accepted, in bytes
+MAX_BODY = 1024 * 1024
+
+REASONS = {200: "OK",
+           400: "Bad Request",
+           404: "Not Found",
+           405: "Method Not Allowed",
+           413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+# Seconds to wait for every worker to load the template
+WARM_UP_TIMEOUT = 120
+
+# Per-process state, set up by _init_worker: engine name -> Engine
+_ENGINES = {}
+
+# Barrier shared by all the workers of a pool, for _ready
+_BARRIER = None
+
+
+def _init_worker(template, barrier):
+    global _BARRIER
+    _BARRIER = barrier
+    for engine in ENGINES:
+        _ENGINES[engine] = get_engine(engine, template)
+        _ENGINES[engine].load()
+
+
+def _ready():
+    """
+    Wait until as many workers as the barrier has parties are in _ready,
+    so every call runs in a different, initialized process; returns its
+    pid.
+    """
+    _BARRIER.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+
+def _fill(engine, ta_data):
+    """
+    Fill and serialize one form in a worker; returns the PDF bytes.
+    """
+    return _ENGINES[engine].render(ta_data)
+
+
+def _number(value, path):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("{0}: expected a number, got {1}".format(
+            path, json.dumps(value)))
+    return float(value)
+
+
+def parse_record(record):
+    """
+    Return the TA dict, as parse_lines returns it, for a TA record given
+    as JSON. It gets the same checks as a data file (hours under 0.1
+    dropped, hours that add up to the total, at most 12 detailed rows);
+    errors are raised as ValueError naming the offending field, such as
+    "detailed[2][1]".
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object")
+    for key in ("name", "total"):
+        if key not in record:
+            raise ValueError("{0}: missing".format(key))
+    if not isinstance(record["name"], str):
+        raise ValueError("name: expected a string, got {0}".format(
+            json.dumps(record["name"])))
+    ta = {"name": record["name"].strip(),
+          "total": _number(record["total"], "total"),
+          "detailed": [],
+          "summary": {}}
+    detailed = record.get("detailed", [])
+    if not isinstance(detailed, list):
+        raise ValueError("detailed: expected a list")
+    total_hours = 0
+    for index, row in enumerate(detailed):
+        path = "detailed[{0}]".format(index)
+        if not isinstance(row, list) or len(row) != 3:
+            raise ValueError("{0}: expected [activity, category, hours]"
+                             .format(path))
+        activity, category, hours = row
+        if not isinstance(activity, str) or not activity.strip():
+            raise ValueError("{0}[0]: expected an activity name".format(path))
+        if category not in DDAH_CATEGORIES:
+            raise ValueError("{0}[1]: unknown category {1}, expected one of "
+                             "{2}".format(path, json.dumps(category),
+                                         ", ".join(sorted(DDAH_CATEGORIES))))
+        hours = _number(hours, path + "[2]")
+        if hours < 0.1:
+            continue
+        ta["detailed"].append((activity.strip(), category, hours))
+        ta["summary"][category] = ta["summary"].get(category, 0) + hours
+        total_hours += hours
+
+    if total_hours != ta["total"]:
+        raise ValueError("total: Total contract hours is {0} but {1} hours "
+                         "are assigned".format(ta["total"], total_hours))
+    if len(ta["detailed"]) > 12:
+        raise ValueError("detailed: DDAH form supports at most 12 rows of "
+                         "detailed activity, but there are {0}".format(
+                             len(ta["detailed"])))
+    return ta
+
+
+def parse_request(body, content_type):
+    """
+    Parse the TA in a request body, as JSON or sample_data.txt text.
+    """
+    if content_type.split(";")[0].strip() == "application/json":
+        try:
+            record = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            raise ValueError("Invalid JSON: {0}".format(e))
+        return parse_record(record)
+    text = body.decode("utf-8")
+    return parse_lines(enumerate(text.splitlines(), 1), "request")
+
+
+class FillService(object):
+    """
+    The HTTP front end: parses requests on the event loop and hands the
+    filling to a process pool.
+    """
+
+    def __init__(self, template="DDAH.pdf", workers=None, engine="acroform"):
+        if engine not in ENGINES and engine != "auto":
+            raise ValueError("Unknown engine {0}, expected one of {1}".format(
+                engine, ", ".join(sorted(ENGINES) + ["auto"])))
+        self.engine = resolve_engine(engine, template)
+        # The engine "?engine=auto" stands for, calibrated off the event
+        # loop (see warm_up and auto_engine)
+        self._auto_engine = self.engine if engine == "auto" else None
+        self.template = template
+        self.workers = workers or os.cpu_count()
+        barrier = multiprocessing.Barrier(self.workers)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_init_worker,
+            initargs=(template, barrier))
+
+    def close(self):
+        self.pool.shutdown()
+
+    async def warm_up(self):
+        """
+        Start every worker, so that the first requests do not pay for
+        loading the template.
+
+        The _ready calls wait for each other on a barrier, so none of them
+        returns before all the workers have run _init_worker; their pids
+        are checked to make sure each ran in its own process. The engine
+        "?engine=auto" stands for is calibrated meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(self.pool, _ready)
+                   for i in range(self.workers)]
+        pids, _ = await asyncio.gather(asyncio.gather(*futures),
+                                            self.auto_engine())
+        if len(set(pids)) != self.workers:
+            raise RuntimeError("Only {0} of {1} workers started".format(
+                len(set(pids)), self.workers))
+
+    async def auto_engine(self):
+        """
+        Return the engine choose_engine picks for the template. The
+        calibration runs once, in a thread, so that it does not block the
+        event loop.
+        """
+        if self._auto_engine is None:
+            loop = asyncio.get_running_loop()
+            self._auto_engine = await loop.run_in_executor(
+                None, resolve_engine, "auto", self.template)
+        return self._auto_engine
+
+    async def fill(self, ta_data, engine=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, _fill,
+                                          engine or self.engine, ta_data)
+
+    async def respond(self, method, target, headers, body):
+        """
+        Return (status, content type, body) for one request.
+        """
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/health":
+            return 200, "text/plain", b"ok\n"
+        if url.path != "/fill":
+            return 404, "text/plain", b"Not found\n"
+        if method != "POST":
+            return 405, "text/plain", b"Use POST\n"
+
+        query = urllib.parse.parse_qs(url.query)
+        engine = query.get("engine", [self.engine])[0]
+        if engine == "auto":
+            engine = await self.auto_engine()
+        if engine not in ENGINES:
+            return 400, "text/plain", "Unknown engine {0}\n".format(
+                engine).encode("utf-8")
+        try:
+            ta_data = parse_request(body, headers.get("content-type", ""))
+        except (ValueError, UnicodeDecodeError) as e:
+            return 400, "text/plain", "{0}\n".format(e).encode("utf-8")
+        try:
+            pdf = await self.fill(ta_data, engine)
+        except Exception as e:
+            message = "{0}: {1}\n".format(type(e).__name__, e)
+            return 500, "text/plain", message.encode("utf-8")
+        return 200, "application/pdf", pdf
+
+    async def handle(self, reader, writer):
+        """
+        Serve the requests of one connection (HTTP/1.1, keep-alive).
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = \
+                        request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0) or 0)
+                if length > MAX_BODY:
+                    await self.send(writer, 413, "text/plain",
+                                    b"Request too large\n", close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, content_type, response = await self.respond(
+                    method, target, headers, body)
+                close = (headers.get("connection", "").lower() == "close" or
+                         version == "HTTP/1.0")
+                await self.send(writer, status, content_type, response, close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, content_type, body, close=False):
+        head = ["HTTP/1.1 {0} {1}".format(status, REASONS[status]),
+                "Content-Type: {0}".format(content_type),
+                "Content-Length: {0}".format(len(body))]
+        if close:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+
+
+async def serve(service, host="127.0.0.1", port=8338, unix=None):
+    """
+    Run service until cancelled, on a TCP port or on the Unix socket unix.
+    """
+    await service.warm_up()
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, path=unix)
+        print("Serving DDAH forms on {0}".format(unix))
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        print("Serving DDAH forms on http://{0}:{1}/".format(host, port))
+    sys.stdout.flush()
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve DDAH forms over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8338)
+    parser.add_argument("--unix", metavar="PATH",
+                        help="listen on this Unix socket instead of a port")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--engine", choices=sorted(ENGINES) + ["auto"],
+                        default="acroform",
+                        help="engine used when a request does not name one; "
+                             "auto picks the fastest correct one (see "
+                             "engines.py)")
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+
+    service = FillService(args.template, args.workers, args.engine)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
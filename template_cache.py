@@ -0,0 +1,409 @@
+"""
+Parse the DDAH template once and hand out cheap per-TA copies of it.
+
+pdfrw's PdfReader is the most expensive part of filling a single form, so
+batch runs should parse DDAH.pdf once and call TemplateCache.clone() for
+every TA instead of calling PdfReader(TEMPLATE) each time.
+
+Each new process would still pay for PdfReader once, which is most of the
+run time of a single-form run (e.g. from cron or a CI hook). So the parsed
+object graph and its clone plan are also saved next to the template as a
+snapshot file, keyed by the template's hash and the pdfrw version; later
+processes rebuild the objects from it instead of tokenizing the PDF again.
+
+The snapshot only holds plain values (tuples, lists, strings, numbers), so
+it is written with marshal rather than pickle: decoding it does not call
+arbitrary functions the way unpickling does. The SHA-256 of its data is
+checked before decoding, but that digest is stored in the snapshot itself,
+so it only catches a truncated or corrupted file, not a deliberately
+altered one, and marshal is not meant for untrusted data either. Keep the
+snapshot where only the people who may change the template can write.
+"""
+import hashlib
+import json
+import marshal
+import os
+import zlib
+
+import pdfrw
+from pdfrw import PdfReader, PdfDict, PdfArray, PdfObject, PdfString
+from pdfrw.objects.pdfname import BasePdfName
+
+from profiling import stage
+
+# Annotation Key used by pdfrw
+ANNOT_KEY = '/Annots'
+
+# Bump when the snapshot layout changes
+SNAPSHOT_VERSION = 2
+
+# marshal format version of the snapshot data
+SNAPSHOT_MARSHAL = 4
+
+# Kinds of the objects of a snapshot
+_DICT, _ARRAY, _NAME, _OBJECT, _STRING = range(5)
+
+# Parsed templates, keyed by (absolute path, modification time)
+_CACHE = {}
+
+
+def template_hash(template="DDAH.pdf"):
+    """
+    Return the SHA-256 hex digest of the template file.
+    """
+    with open(template, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def snapshot_path(template="DDAH.pdf"):
+    return template + ".snapshot"
+
+
+def _children(obj):
+    """
+    Return the objects directly referenced by obj, resolving any indirect
+    references on the way.
+    """
+    if isinstance(obj, PdfDict):
+        return [value for key, value in obj.iteritems()]
+    if isinstance(obj, PdfArray):
+        return list(obj)
+    return []
+
+
+def _field_tree(node, out):
+    """
+    Collect node and every descendant reachable through /Kids.
+    """
+    out.append(node)
+    if node.Kids is not None:
+        out.append(node.Kids)
+        for kid in node.Kids:
+            _field_tree(kid, out)
+
+
+def _clone_plan(template_pdf):
+    """
+    Work out which objects of template_pdf a clone has to copy.
+
+    These are the objects that filling a form modifies (page tree, pages,
+    page resources, annotations and the AcroForm field tree) plus every
+    object that refers to them, such as the structure tree. Without the
+    latter, a written clone would still reference the pristine pages and
+    annotations and PdfWriter would output both versions.
+    """
+    # Resolve the whole object graph up front, so clones never trigger
+    # lazy loads from the reader and all references are real objects.
+    containers = {}
+    parents = {}
+    stack = [template_pdf]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in containers:
+            continue
+        children = _children(obj)
+        if isinstance(obj, (PdfDict, PdfArray)):
+            containers[id(obj)] = obj
+        for child in children:
+            parents.setdefault(id(child), []).append(obj)
+            stack.append(child)
+
+    seed = []
+    _field_tree(template_pdf.Root.Pages, seed)
+    for page in template_pdf.pages:
+        resources = page.Resources
+        if resources is not None:
+            seed.append(resources)
+            if resources.XObject is not None:
+                seed.append(resources.XObject)
+        if page[ANNOT_KEY] is not None:
+            seed.append(page[ANNOT_KEY])
+            seed.extend(page[ANNOT_KEY])
+    acroform = template_pdf.Root.AcroForm
+    if acroform is not None:
+        seed.append(acroform)
+        if acroform.Fields is not None:
+            seed.append(acroform.Fields)
+            for field in acroform.Fields:
+                _field_tree(field, seed)
+
+    plan = {}
+    stack = [obj for obj in seed if id(obj) in containers]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in plan:
+            continue
+        plan[id(obj)] = obj
+        stack.extend(parents.get(id(obj), []))
+    return list(plan.values())
+
+
+def _shallow_copy(obj):
+    """
+    Copy a single PdfDict or PdfArray, keeping its indirect flag and stream.
+    """
+    if isinstance(obj, PdfDict):
+        new = PdfDict()
+        dict.update(new, obj)
+        new.indirect = obj.indirect
+        if obj.stream is not None:
+            new._stream = obj.stream
+    else:
+        new = PdfArray(list.__iter__(obj))
+        new.indirect = obj.indirect
+    return new
+
+
+def _indirect(obj):
+    """
+    Return the indirect flag of obj as a plain value: its (object
+    number, generation) if it came from a file, else a bool.
+    """
+    if isinstance(obj.indirect, tuple):
+        return tuple(obj.indirect)
+    return bool(obj.indirect)
+
+
+def encode_snapshot(template_pdf, plan):
+    """
+    Flatten the object graph of template_pdf (fully resolved, as after
+    _clone_plan) into a dict of plain values. Every object becomes one
+    entry of "objects" and references become indexes into that list.
+
+    Raises ValueError if the graph holds an object of an unexpected type.
+    """
+    numbers = {}
+    order = []
+
+    def number(obj):
+        n = numbers.get(id(obj))
+        if n is None:
+            n = numbers[id(obj)] = len(order)
+            order.append(obj)
+        return n
+
+    number(template_pdf)
+    objects = []
+    # order grows while it is walked, so this visits the whole graph
+    for obj in order:
+        if isinstance(obj, PdfDict):
+            items = [(str(key.encoded or key), number(value))
+                     for key, value in obj.iteritems()]
+            stream = obj.stream
+            if stream is not None:
+                # Raw stream data, one character per byte
+                stream = stream.encode("latin-1")
+            objects.append((_DICT, _indirect(obj), stream, items))
+        elif isinstance(obj, PdfArray):
+            objects.append((_ARRAY, _indirect(obj),
+                            [number(value) for value in obj]))
+        elif isinstance(obj, BasePdfName):
+            objects.append((_NAME, _indirect(obj), str(obj.encoded or obj)))
+        elif isinstance(obj, PdfString):
+            objects.append((_STRING, _indirect(obj), str(obj)))
+        elif isinstance(obj, PdfObject):
+            objects.append((_OBJECT, _indirect(obj), str(obj)))
+        else:
+            raise ValueError("Cannot snapshot a {0}".format(
+                type(obj).__name__))
+    return {"objects": objects,
+            "pages": [numbers[id(page)] for page in template_pdf.pages],
+            "plan": [numbers[id(obj)] for obj in plan]}
+
+
+def decode_snapshot(snapshot):
+    """
+    Rebuild the objects of a snapshot made by encode_snapshot; returns
+    (trailer, clone plan). The trailer is a PdfDict with a .pages
+    attribute, like a PdfReader.
+    """
+    names = {}
+    objects = []
+    for entry in snapshot["objects"]:
+        kind = entry[0]
+        if kind == _DICT:
+            obj = PdfDict()
+        elif kind == _ARRAY:
+            obj = PdfArray()
+        elif kind == _NAME:
+            obj = names.get(entry[2])
+            if obj is None:
+                obj = names[entry[2]] = BasePdfName(entry[2])
+        elif kind == _STRING:
+            obj = PdfString(entry[2])
+        else:
+            obj = PdfObject(entry[2])
+        if entry[1] and kind != _NAME:
+            obj.indirect = entry[1]
+        objects.append(obj)
+
+    for obj, entry in zip(objects, snapshot["objects"]):
+        if entry[0] == _DICT:
+            for key, n in entry[3]:
+                name = names.get(key)
+                if name is None:
+                    name = names[key] = BasePdfName(key)
+                dict.__setitem__(obj, name, objects[n])
+            if entry[2] is not None:
+                obj._stream = entry[2].decode("latin-1")
+        elif entry[0] == _ARRAY:
+            list.extend(obj, [objects[n] for n in entry[2]])
+
+    trailer = objects[0]
+    trailer.private.pages = [objects[n] for n in snapshot["pages"]]
+    return trailer, [objects[n] for n in snapshot["plan"]]
+
+
+def _snapshot_header(digest):
+    return {"version": SNAPSHOT_VERSION,
+            "template_sha256": digest,
+            "pdfrw": pdfrw.__version__}
+
+
+def read_snapshot(template="DDAH.pdf", digest=None):
+    """
+    Return (trailer, clone plan) from the snapshot of template, or None if
+    there is none, it was made from another template or pdfrw version, or
+    its data does not match the digest in its header.
+
+    The snapshot is a JSON header line followed by the compressed marshal
+    data; the header holds the SHA-256 of that data, to detect corruption
+    (not tampering, see the module docstring).
+    """
+    expected = _snapshot_header(digest or template_hash(template))
+    try:
+        with open(snapshot_path(template), "rb") as f:
+            header = json.loads(f.readline().decode("ascii"))
+            data = f.read()
+        payload_digest = header.pop("sha256")
+        if header != expected:
+            return None
+        if hashlib.sha256(data).hexdigest() != payload_digest:
+            return None
+        return decode_snapshot(marshal.loads(zlib.decompress(data)))
+    except Exception:
+        # Missing, truncated or unreadable: parse the template instead
+        return None
+
+
+def write_snapshot(template_pdf, plan, template="DDAH.pdf", digest=None):
+    """
+    Save the parsed template_pdf and its clone plan as the snapshot of
+    template. Returns False if the snapshot could not be written.
+    """
+    header = _snapshot_header(digest or template_hash(template))
+    path = snapshot_path(template)
+    try:
+        snapshot = encode_snapshot(template_pdf, plan)
+        data = zlib.compress(marshal.dumps(snapshot, SNAPSHOT_MARSHAL))
+        header["sha256"] = hashlib.sha256(data).hexdigest()
+        # Write a temporary file and rename it, so that a process starting
+        # meanwhile never reads half a snapshot
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps(header, sort_keys=True).encode("ascii"))
+                f.write(b"\n")
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except (IOError, OSError, ValueError):
+        # The snapshot is only a cache; a read-only directory is fine
+        return False
+    return True
+
+
+class TemplateCache(object):
+    """
+    A parsed DDAH template that can be cloned once per TA.
+
+    The pristine object graph is never modified. clone() returns a trailer
+    that can be filled and passed to PdfWriter().write; it only copies the
+    objects filling touches and shares everything else (fonts, content
+    streams, appearance streams, ...) with the template.
+    """
+
+    def __init__(self, template="DDAH.pdf", snapshot=True):
+        self.path = template
+        with stage("template_parse"):
+            loaded = None
+            if snapshot:
+                digest = template_hash(template)
+                loaded = read_snapshot(template, digest)
+            if loaded is not None:
+                self.template, self._plan = loaded
+            else:
+                self.template = PdfReader(template)
+                self._plan = _clone_plan(self.template)
+                if snapshot:
+                    write_snapshot(self.template, self._plan, template,
+                                   digest)
+
+    def clone(self):
+        """
+        Return a fillable copy of the template, with a .pages attribute
+        like the one PdfReader provides.
+        """
+        with stage("template_clone"):
+            return self._clone()
+
+    def derive(self, fill):
+        """
+        Return a TemplateCache whose template is a clone of this one with
+        fill(clone) applied, e.g. with the fields that every TA of a course
+        shares already filled in. fill must modify the clone in place.
+        """
+        copies = self._copy()
+        trailer = copies[id(self.template)]
+        fill(trailer)
+        derived = TemplateCache.__new__(TemplateCache)
+        derived.path = self.path
+        derived.template = trailer
+        # The clone's copies are exactly the objects its own clones copy
+        derived._plan = [copies[id(obj)] for obj in self._plan]
+        return derived
+
+    def _clone(self):
+        return self._copy()[id(self.template)]
+
+    def _copy(self):
+        """
+        Copy the objects of the plan; returns {id(original): copy}.
+        """
+        copies = {}
+        for obj in self._plan:
+            copies[id(obj)] = _shallow_copy(obj)
+
+        # Point the copies at each other instead of at the originals
+        for new in copies.values():
+            if isinstance(new, PdfDict):
+                for key, value in list(dict.items(new)):
+                    other = copies.get(id(value))
+                    if other is not None:
+                        dict.__setitem__(new, key, other)
+            else:
+                for index, value in enumerate(list.__iter__(new)):
+                    other = copies.get(id(value))
+                    if other is not None:
+                        list.__setitem__(new, index, other)
+
+        trailer = copies[id(self.template)]
+        trailer.private.pages = [copies[id(page)]
+                                 for page in self.template.pages]
+        return copies
+
+
+def load_template(template="DDAH.pdf"):
+    """
+    Return the TemplateCache for template, loading it only the first time
+    it is requested (or after it changes on disk).
+    """
+    path = os.path.abspath(template)
+    key = (path, os.path.getmtime(path))
+    cache = _CACHE.get(key)
+    if cache is None:
+        cache = _CACHE[key] = TemplateCache(template)
+    return cache
@@ -0,0 +1,14 @@
+"""
+The modules are top-level scripts, so the tests import them from the root
+of the repository.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# The DDAH template and the sample TA shipped with the repository
+TEMPLATE = os.path.join(ROOT, "DDAH.pdf")
+SAMPLE_DATA = os.path.join(ROOT, "sample_data.txt")
@@ -0,0 +1,28 @@
+import pytest
+
+import batch
+from conftest import SAMPLE_DATA, TEMPLATE
+
+
+def test_run_batch(tmp_path):
+    outdir = str(tmp_path / "out")
+    summary = batch.run_batch([SAMPLE_DATA], outdir, workers=1,
+                              template=TEMPLATE)
+    assert summary["failed"] == []
+    assert len(summary["written"]) == 1
+
+
+@pytest.mark.parametrize("engine", ["acroform", "auto"])
+def test_missing_template_fails_before_the_pool(tmp_path, engine):
+    with pytest.raises(ValueError, match="Cannot load template"):
+        batch.run_batch([SAMPLE_DATA], str(tmp_path), engine=engine,
+                        workers=2, template=str(tmp_path / "missing.pdf"))
+
+
+def test_worker_with_missing_template_fails_each_job(tmp_path):
+    # Raising from the initializer would make the Pool hang
+    batch._init_worker("acroform", str(tmp_path / "missing.pdf"))
+    data_file, pdf_out_file, error, events, stats = batch._process(
+        (SAMPLE_DATA, str(tmp_path / "ta.pdf")))
+    assert pdf_out_file is None
+    assert error.startswith("FileNotFoundError")
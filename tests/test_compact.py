@@ -0,0 +1,12 @@
+from conftest import SAMPLE_DATA, TEMPLATE
+from engines import get_engine
+from roster import parse_data
+
+
+def test_compact_output_is_smaller():
+    ta_data = parse_data(SAMPLE_DATA)
+    plain = get_engine("acroform", TEMPLATE).render(ta_data)
+    engine = get_engine("acroform", TEMPLATE, compact=6)
+    data = engine.render(ta_data)
+    assert len(data) < len(plain)
+    assert engine.check(ta_data, data) == []
@@ -0,0 +1,34 @@
+import json
+import os
+
+import pytest
+
+from department import load_config
+
+INFO = {"Department": "MCS", "Course Title": "Title",
+        "Tutorial Category": "Skills Development",
+        "Supervising Professor": "Prof", "Est. Enrolment / TA Section": 30,
+        "Expected Enrolment (course)": 90}
+
+
+def write_config(tmp_path, codes):
+    path = tmp_path / "term.json"
+    path.write_text(json.dumps({
+        "info": INFO, "approver": "A", "date": "D",
+        "courses": [{"info": {"Course Code": code}, "tas": ["tas/"]}
+                    for code in codes]}))
+    return str(path)
+
+
+def test_load_config(tmp_path):
+    courses = load_config(write_config(tmp_path, ["CSC108", "CSC148"]))
+    assert [course.code for course in courses] == ["CSC108", "CSC148"]
+    assert courses[0].sources == [os.path.join(str(tmp_path), "tas/")]
+
+
+@pytest.mark.parametrize("codes", [["CSC108", "CSC108"],
+                                   ["CSC 108", "CSC_108"]])
+def test_duplicate_course_codes(tmp_path, codes):
+    with pytest.raises(ValueError) as error:
+        load_config(write_config(tmp_path, codes))
+    assert "courses 1 and 2" in str(error.value)
@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import SAMPLE_DATA, TEMPLATE
+from engines import get_engine, sample_ta
+from roster import parse_data
+
+
+@pytest.mark.parametrize("name", ["acroform", "fdf"])
+def test_engine_output_is_correct(name):
+    engine = get_engine(name, TEMPLATE)
+    assert engine.check(parse_data(SAMPLE_DATA)) == []
+    assert engine.check(sample_ta()) == []
+
+
+def test_overlay_output_is_correct():
+    pytest.importorskip("reportlab")
+    engine = get_engine("overlay", TEMPLATE)
+    assert engine.check(sample_ta()) == []
+
+
+def test_check_finds_wrong_values():
+    engine = get_engine("acroform", TEMPLATE)
+    ta_data = parse_data(SAMPLE_DATA)
+    data = engine.render(ta_data)
+    other = dict(ta_data, name="Someone Else")
+    problems = engine.check(other, data)
+    assert problems and "Someone Else" in problems[0]
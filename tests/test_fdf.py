@@ -0,0 +1,60 @@
+import shutil
+import zipfile
+
+import pytest
+
+from conftest import SAMPLE_DATA, TEMPLATE
+from convert import form_values
+from fdf import load_skeleton, pdf_string, write_fdf_batch
+from roster import parse_data
+
+
+
+def test_pdf_string_escapes():
+    assert pdf_string("a(b)c\\d") == b"(a\\(b\\)c\\\\d)"
+    assert pdf_string("one\ntwo\r\tthree") == b"(one\\ntwo\\r\\tthree)"
+    assert pdf_string(30) == b"(30)"
+
+
+def test_pdf_string_unicode():
+    assert pdf_string("Zoë") == b"<FEFF005A006F00EB>"
+
+
+def test_fdf_holds_every_value():
+    values = form_values(parse_data(SAMPLE_DATA))
+    document = load_skeleton(TEMPLATE).fdf(values)
+    assert document.startswith(b"%FDF-")
+    assert b"(Fib Fob)" in document
+
+
+def test_xfdf_escapes_markup():
+    skeleton = load_skeleton(TEMPLATE)
+    name = form_values(parse_data(SAMPLE_DATA))[0][0]
+    document = skeleton.xfdf([(name, "<A & B>")])
+    assert b"&lt;A &amp; B&gt;" in document
+
+
+@pytest.fixture
+def same_names(tmp_path):
+    data_files = []
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        path = tmp_path / directory / "ta.txt"
+        shutil.copy(SAMPLE_DATA, str(path))
+        data_files.append(str(path))
+    return data_files
+
+
+def test_same_names_in_outdir_are_refused(tmp_path, same_names):
+    outdir = tmp_path / "out"
+    with pytest.raises(ValueError, match="overwrite"):
+        write_fdf_batch(same_names, str(outdir), template=TEMPLATE)
+    assert not outdir.exists()
+
+
+def test_same_names_in_archive_are_numbered(tmp_path, same_names):
+    archive = str(tmp_path / "fdf.zip")
+    summary = write_fdf_batch(same_names, archive=archive, template=TEMPLATE)
+    assert summary == {"written": ["ta.fdf", "ta_2.fdf"], "failed": []}
+    with zipfile.ZipFile(archive) as zip_file:
+        assert zip_file.namelist() == ["ta.fdf", "ta_2.fdf"]
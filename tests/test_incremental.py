@@ -0,0 +1,14 @@
+from conftest import SAMPLE_DATA, TEMPLATE
+from engines import get_engine
+from roster import parse_data
+
+
+def test_incremental_output_keeps_the_template():
+    engine = get_engine("acroform", TEMPLATE, incremental=True)
+    ta_data = parse_data(SAMPLE_DATA)
+    data = engine.render(ta_data)
+    with open(TEMPLATE, "rb") as f:
+        template = f.read()
+    assert data.startswith(template)
+    assert len(data) > len(template)
+    assert engine.check(ta_data, data) == []
@@ -0,0 +1,44 @@
+from manifest import Manifest, build_key
+
+INFO_FIELDS = {"Course Code": "CSC338"}
+
+
+def key(data_file, **changes):
+    inputs = dict(engine="acroform", template_digest="0" * 64,
+                  info_fields=INFO_FIELDS, approver="A", date="D")
+    inputs.update(changes)
+    return build_key(data_file, **inputs)
+
+
+def test_key_changes_with_every_input(tmp_path):
+    data_file = tmp_path / "ta.txt"
+    data_file.write_text("Full Name: A\n")
+    base = key(str(data_file))
+    assert key(str(data_file)) == base
+    assert key(str(data_file), engine="overlay") != base
+    assert key(str(data_file), template_digest="1" * 64) != base
+    assert key(str(data_file), info_fields={"Course Code": "CSC108"}) != base
+    assert key(str(data_file), approver="B") != base
+    assert key(str(data_file), date="E") != base
+    data_file.write_text("Full Name: B\n")
+    assert key(str(data_file)) != base
+
+
+def test_staleness(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    pdf = tmp_path / "ta.pdf"
+    manifest = Manifest(path)
+    assert not manifest.is_up_to_date(str(pdf), "k1")
+
+    pdf.write_bytes(b"%PDF")
+    manifest.record(str(pdf), "ta.txt", "k1")
+    manifest.save()
+    manifest = Manifest(path)
+    assert manifest.is_up_to_date(str(pdf), "k1")
+    assert not manifest.is_up_to_date(str(pdf), "k2")
+
+    pdf.unlink()
+    assert not manifest.is_up_to_date(str(pdf), "k1")
+
+    manifest.forget(str(pdf))
+    assert str(pdf) not in manifest.entries
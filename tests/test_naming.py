@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from naming import check_output_paths, ta_output_path, unique_name
+
+
+def test_unique_name():
+    used = {}
+    names = [unique_name(name, used)
+             for name in ["a", "a", "a_2", "a", "a_3", "b"]]
+    assert names == ["a", "a_2", "a_2_2", "a_3", "a_3_2", "b"]
+
+
+def test_ta_output_path():
+    used = {}
+    assert ta_output_path("out", "Jane Doe", used) == os.path.join(
+        "out", "Jane_Doe.pdf")
+    assert ta_output_path("out", "Jane/Doe", used) == os.path.join(
+        "out", "Jane_Doe_2.pdf")
+
+
+def test_output_collisions(tmp_path):
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "ta.txt").write_text("")
+    a = str(tmp_path / "a" / "ta.txt")
+    b = str(tmp_path / "b" / "ta.txt")
+    check_output_paths([a, b])
+    check_output_paths([a, a], str(tmp_path / "out"))
+    with pytest.raises(ValueError) as error:
+        check_output_paths([a, b], str(tmp_path / "out"))
+    assert a in str(error.value) and b in str(error.value)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import archive
+import pipeline
+from conftest import SAMPLE_DATA, TEMPLATE
+
+
+@pytest.fixture
+def roster(tmp_path):
+    with open(SAMPLE_DATA) as f:
+        sample = f.read()
+    path = tmp_path / "roster.txt"
+    path.write_text(sample * 5)
+    return str(path)
+
+
+def test_duplicate_names_are_numbered(tmp_path, roster):
+    outdir = str(tmp_path / "out")
+    summary = pipeline.run_pipeline([roster], outdir, workers=1,
+                                    template=TEMPLATE)
+    assert summary == {"written": 5, "failed": []}
+    assert sorted(os.listdir(outdir)) == [
+        "Fib_Fob.pdf", "Fib_Fob_2.pdf", "Fib_Fob_3.pdf", "Fib_Fob_4.pdf",
+        "Fib_Fob_5.pdf"]
+
+
+def test_writer_failure_stops_the_run(tmp_path, roster, monkeypatch):
+    def fail(self, name, data):
+        raise RuntimeError("writer failed")
+
+    monkeypatch.setattr(archive.ArchiveWriter, "write", fail)
+    with pytest.raises(RuntimeError, match="writer failed"):
+        pipeline.run_pipeline([roster], archive=str(tmp_path / "forms.zip"),
+                              workers=1, template=TEMPLATE, queue_size=1)
+
+
+def test_missing_template_fails_before_starting(tmp_path, roster):
+    with pytest.raises(ValueError, match="Cannot load template"):
+        pipeline.run_pipeline([roster], str(tmp_path / "out"), workers=2,
+                              template=str(tmp_path / "missing.pdf"))
+    assert not os.path.exists(str(tmp_path / "out"))
+
+
+def test_worker_with_missing_template_fails_each_job(tmp_path):
+    pipeline._init_worker("acroform", str(tmp_path / "missing.pdf"))
+    source, target, data, error = pipeline._render(
+        ("roster.txt", "ta.pdf", {"name": "A"}))
+    assert data is None
+    assert error.startswith("FileNotFoundError")
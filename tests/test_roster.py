@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import SAMPLE_DATA
+from roster import RosterError, iter_blocks, parse_data, parse_lines
+
+
+def lines(text):
+    return enumerate(text.splitlines(), 1)
+
+
+def test_parse_sample_data():
+    ta = parse_data(SAMPLE_DATA)
+    assert ta["name"] == "Fib Fob"
+    assert ta["total"] == 135
+    assert len(ta["detailed"]) == 10
+    assert ta["detailed"][0] == ("Lab/tutorial hours", "CONTACT HOURS", 30)
+    assert ta["summary"] == {"CONTACT HOURS": 32, "MARKING HOURS": 76,
+                             "PREP HOURS": 24, "INVIGILATION HOURS": 3}
+
+
+def test_name_case_and_tabs():
+    ta = parse_lines(lines("FULL NAME:\tJane Doe\n"
+                           "Total contract hours:\t10\t\n"
+                           "CONTACT HOURS:\n"
+                           "Office hours:\t_10_\t\n"
+                           "Exam marking hours: _\n"))
+    assert ta["name"] == "Jane Doe"
+    assert ta["detailed"] == [("Office hours", "CONTACT HOURS", 10.0)]
+
+
+def test_total_mismatch_is_located():
+    with pytest.raises(RosterError) as error:
+        parse_lines(lines("Full Name: A\n"
+                          "Total contract hours: 5\n"
+                          "CONTACT HOURS:\n"
+                          "Office hours: 4\n"), "a.txt")
+    assert error.value.filename == "a.txt"
+    assert error.value.lineno == 2
+
+
+def test_every_problem_is_collected():
+    errors = []
+    ta = parse_lines(lines("Full Name: A\n"
+                           "Total contract hours: 5\n"
+                           "Office hours: 5\n"
+                           "CONTACT HOURS:\n"
+                           "Lab/tutorial hours: x\n"
+                           "garbage\n"), "a.txt", errors)
+    assert ta is None
+    assert [error.lineno for error in errors] == [3, 5, 6]
+
+
+def test_too_many_rows():
+    text = "Full Name: A\nTotal contract hours: 13\nCONTACT HOURS:\n"
+    text += "".join("Activity {0}: 1\n".format(i) for i in range(13))
+    with pytest.raises(RosterError) as error:
+        parse_lines(lines(text))
+    assert "at most 12 rows" in error.value.message
+    assert error.value.lineno == 16
+
+
+def test_iter_blocks(tmp_path):
+    roster = tmp_path / "roster.txt"
+    with open(SAMPLE_DATA) as f:
+        sample = f.read()
+    roster.write_text(sample + sample)
+    blocks = list(iter_blocks(str(roster)))
+    assert len(blocks) == 2
+    assert [parse_lines(block)["name"] for block in blocks] == ["Fib Fob"] * 2
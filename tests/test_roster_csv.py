@@ -0,0 +1,60 @@
+import pytest
+
+from roster import RosterError
+
+pytest.importorskip("numpy")
+from roster_csv import load_csv
+
+HEADER = "Full Name,Total contract hours,Office hours,Exam marking hours\n"
+
+
+def write(tmp_path, text, name="roster.csv"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_empty_roster(tmp_path):
+    with pytest.raises(RosterError) as error:
+        load_csv(write(tmp_path, ""))
+    assert error.value.message == "Empty roster"
+    assert error.value.lineno == 1
+
+
+def test_records(tmp_path):
+    roster = load_csv(write(tmp_path, HEADER + "Jane Doe,10,4,6\n"))
+    assert list(roster.ta_records()) == [
+        {"name": "Jane Doe", "total": 10.0,
+         "detailed": [("Office hours", "CONTACT HOURS", 4.0),
+                      ("Exam marking hours", "MARKING HOURS", 6.0)],
+         "summary": {"CONTACT HOURS": 4.0, "MARKING HOURS": 6.0}}]
+
+
+def test_line_numbers_after_blank_rows(tmp_path):
+    roster = load_csv(write(tmp_path, HEADER + "\nA,5,5,\n\n\nB,3,2,\n"))
+    assert roster.linenos == [3, 6]
+    valid, errors = roster.check()
+    assert list(valid) == [True, False]
+    assert [error.lineno for error in errors] == [6]
+
+
+def test_every_bad_cell_is_reported(tmp_path):
+    roster = load_csv(write(tmp_path, HEADER + "A,5,5,\n"
+                                                "B,3,x,y\n"
+                                                "C,4,4,\n"
+                                                "D,zz,1,\n"))
+    errors = []
+    names = [ta["name"] for ta in roster.ta_records(errors)]
+    assert names == ["A", "C"]
+    assert [(error.lineno, error.message) for error in errors] == [
+        (3, "x is not a number (Office hours)"),
+        (3, "y is not a number (Exam marking hours)"),
+        (5, "zz is not a number (Total contract hours)")]
+
+
+def test_tsv_and_explicit_category(tmp_path):
+    path = write(tmp_path, "Full Name\tTotal contract hours\t"
+                           "PREP HOURS: Reading week prep\n"
+                           "A\t2\t2\n", "roster.tsv")
+    ta, = load_csv(path).ta_records()
+    assert ta["detailed"] == [("Reading week prep", "PREP HOURS", 2.0)]
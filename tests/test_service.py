@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from conftest import TEMPLATE
+from engines import PDF_ENGINES
+from service import FillService, parse_record, parse_request
+
+
+def record(**changes):
+    ta = {"name": "Doe: Jane", "total": 30,
+          "detailed": [["Office hours: Wednesdays", "CONTACT HOURS", 20],
+                       ["Exam marking", "MARKING HOURS", 10],
+                       ["Nothing", "PREP HOURS", 0]]}
+    ta.update(changes)
+    return ta
+
+
+def test_parse_record():
+    assert parse_record(record()) == {
+        "name": "Doe: Jane", "total": 30.0,
+        "detailed": [("Office hours: Wednesdays", "CONTACT HOURS", 20.0),
+                     ("Exam marking", "MARKING HOURS", 10.0)],
+        "summary": {"CONTACT HOURS": 20.0, "MARKING HOURS": 10.0}}
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"total": 31}, "total: Total contract hours is 31.0"),
+    ({"total": "30"}, "total: expected a number"),
+    ({"name": None}, "name: expected a string"),
+    ({"detailed": [["Office hours", "CONTACT", 30]]},
+     "detailed[0][1]: unknown category \"CONTACT\""),
+    ({"detailed": [["Office hours", "CONTACT HOURS"]]},
+     "detailed[0]: expected [activity, category, hours]"),
+    ({"detailed": [["Office hours", "CONTACT HOURS", True]]},
+     "detailed[0][2]: expected a number"),
+    ({"total": 13, "detailed": [["Activity", "PREP HOURS", 1]] * 13},
+     "detailed: DDAH form supports at most 12 rows"),
+])
+def test_parse_record_errors(changes, message):
+    with pytest.raises(ValueError) as error:
+        parse_record(record(**changes))
+    assert str(error.value).startswith(message)
+
+
+def test_parse_request():
+    body = b'{"name": "A", "total": 1, "detailed": [["x", "PREP HOURS", 1]]}'
+    ta = parse_request(body, "application/json; charset=utf-8")
+    assert ta["name"] == "A"
+    with pytest.raises(ValueError):
+        parse_request(b"{", "application/json")
+    text = b"Full Name: A\nTotal contract hours: 1\nPREP HOURS:\nx: 1\n"
+    assert parse_request(text, "text/plain") == ta
+
+
+def test_auto_engine_is_calibrated_once():
+    service = FillService(TEMPLATE, workers=1)
+    try:
+        engine = asyncio.run(service.auto_engine())
+        assert engine in PDF_ENGINES
+        assert asyncio.run(service.auto_engine()) == engine
+    finally:
+        service.close()
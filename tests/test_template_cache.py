@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import TEMPLATE
+from template_cache import TemplateCache, read_snapshot, snapshot_path
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = str(tmp_path / "DDAH.pdf")
+    shutil.copy(TEMPLATE, path)
+    return path
+
+
+def test_snapshot_round_trip(template):
+    parsed = TemplateCache(template)
+    assert os.path.exists(snapshot_path(template))
+    loaded = TemplateCache(template)
+    assert len(loaded.template.pages) == len(parsed.template.pages)
+    assert len(loaded._plan) == len(parsed._plan)
+    fields = [annot.T for annot in loaded.template.pages[0].Annots]
+    assert fields == [annot.T for annot in parsed.template.pages[0].Annots]
+
+
+def test_snapshot_is_not_pickle(template):
+    TemplateCache(template)
+    with open(snapshot_path(template), "rb") as f:
+        assert f.read(1) == b"{"
+
+
+def test_corrupted_snapshot_is_ignored(template):
+    TemplateCache(template)
+    path = snapshot_path(template)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    data[len(data) // 2] ^= 1
+    with open(path, "wb") as f:
+        f.write(data)
+    assert read_snapshot(template) is None
+
+
+def test_snapshot_of_other_template_is_ignored(template):
+    TemplateCache(template)
+    with open(template, "ab") as f:
+        f.write(b"\n% changed\n")
+    assert read_snapshot(template) is None
+
+
+def test_clones_do_not_share_filled_objects(template):
+    cache = TemplateCache(template, snapshot=False)
+    first = cache.clone()
+    second = cache.clone()
+    first.pages[0].Annots[0].V = "changed"
+    assert second.pages[0].Annots[0].V != "changed"
+    assert cache.template.pages[0].Annots[0].V != "changed"
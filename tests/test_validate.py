@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import SAMPLE_DATA
+from validate import check_file, validate
+
+
+def test_sample_data_is_valid():
+    assert check_file(SAMPLE_DATA) == (SAMPLE_DATA, 1, 1, [])
+
+
+def test_roster_reports_every_ta(tmp_path):
+    roster = tmp_path / "roster.txt"
+    roster.write_text("Full Name: A\nTotal contract hours: 1\n"
+                      "CONTACT HOURS:\nOffice hours: 1\n"
+                      "====\n"
+                      "Full Name: B\nTotal contract hours: 2\n"
+                      "CONTACT HOURS:\nOffice hours: 1\n")
+    filename, tas, valid, problems = check_file(str(roster))
+    assert (tas, valid) == (2, 1)
+    assert [problem["line"] for problem in problems] == [7]
+
+
+def test_bad_csv_cells_do_not_hide_the_other_rows(tmp_path):
+    pytest.importorskip("numpy")
+    roster = tmp_path / "roster.csv"
+    roster.write_text("Full Name,Total contract hours,Office hours\n"
+                      "A,1,1\nB,x,1\nC,2,2\n")
+    filename, tas, valid, problems = check_file(str(roster))
+    assert (tas, valid) == (3, 2)
+    assert [problem["line"] for problem in problems] == [3]
+
+
+def test_unreadable_files_are_problems(tmp_path):
+    pytest.importorskip("numpy")
+    empty = tmp_path / "empty.csv"
+    empty.write_text("")
+    binary = tmp_path / "binary.txt"
+    binary.write_bytes(b"\xff\xfe\x00garbage")
+    report = validate([str(empty), str(binary), str(tmp_path / "missing.txt")],
+                      workers=2)
+    assert report["files"] == 3
+    assert len(report["problems"]) == 3
@@ -0,0 +1,134 @@
+"""
+Check TA data files and rosters without generating any PDF.
+
+Sample Usage:
+
+    python validate.py tas/
+    python validate.py -j 8 --json rosters/*.txt roster.csv > problems.json
+
+Every TA of every file is checked as parse_data would (hours that add up
+to the total contract hours, at most 12 detailed rows, hours under a
+category, numbers that parse) and all problems are reported at once, with
+their file and line. Nothing here imports pdfrw or loads the template, and
+the files are checked in parallel, so thousands of them take seconds.
+
+The exit status is 1 if there is any problem. With --json, the report is
+a JSON object:
+
+    {"files": 2, "tas": 120, "valid": 119,
+     "problems": [{"file": "roster.txt", "line": 57,
+                   "message": "Total contract hours is 60.0 but ..."}]}
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+from roster import RosterError, find_data_files, iter_blocks, parse_lines
+
+# Extensions of the rosters read by roster_csv.load_csv
+CSV_EXTENSIONS = (".csv", ".tsv", ".tab")
+
+
+def _problem(error, filename):
+    if isinstance(error, RosterError):
+        return {"file": error.filename or filename, "line": error.lineno,
+                "message": error.message}
+    return {"file": filename, "line": None, "message": str(error)}
+
+
+def check_file(filename):
+    """
+    Check every TA in filename, a TA data file, a roster or a CSV/TSV
+    roster. Returns (filename, number of TAs, number of valid TAs, list of
+    problem dicts).
+
+    A file that cannot be read at all is one problem; it never raises, so
+    one bad file does not stop the others from being checked.
+    """
+    errors = []
+    tas = valid = 0
+    try:
+        if filename.lower().endswith(CSV_EXTENSIONS):
+            from roster_csv import load_csv
+            roster = load_csv(filename)
+            rows, errors = roster.check()
+            tas = len(roster)
+            valid = int(rows.sum())
+        else:
+            for block in iter_blocks(filename):
+                tas += 1
+                if parse_lines(block, filename, errors) is not None:
+                    valid += 1
+    except (IOError, UnicodeDecodeError, ValueError, StopIteration,
+            csv.Error) as e:
+        errors.append(e)
+    return filename, tas, valid, [_problem(e, filename) for e in errors]
+
+
+def validate(paths, workers=None):
+    """
+    Check the TA files, rosters, directories and glob patterns in paths
+    with a pool of workers (default: one per core). Returns a report dict
+    with the number of "files", "tas" and "valid" TAs, and the list of
+    "problems", in file order.
+    """
+    data_files = find_data_files(paths)
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(data_files)) or 1
+    if workers == 1:
+        results = [check_file(data_file) for data_file in data_files]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunksize = max(1, len(data_files) // (workers * 4))
+            results = pool.map(check_file, data_files, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    report = {"files": len(data_files), "tas": 0, "valid": 0,
+              "problems": []}
+    for filename, tas, valid, problems in results:
+        report["tas"] += tas
+        report["valid"] += valid
+        report["problems"].extend(problems)
+    return report
+
+
+def format_problem(problem):
+    location = problem["file"]
+    if problem["line"] is not None:
+        location += ":{0}".format(problem["line"])
+    return "{0}: {1}".format(location, problem["message"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check TA data files and rosters without making PDFs.")
+    parser.add_argument("paths", nargs="+",
+                        help="TA data files, rosters, directories or glob "
+                             "patterns")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = validate(args.paths, args.workers)
+    if args.json:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        for problem in report["problems"]:
+            print(format_problem(problem))
+        print("{0} TAs in {1} files: {2} valid, {3} problems".format(
+            report["tas"], report["files"], report["valid"],
+            len(report["problems"])))
+    return 1 if report["problems"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
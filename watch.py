@@ -0,0 +1,360 @@
+"""
+Regenerate the DDAH forms of a directory of TA files as they are edited.
+
+Sample Usage:
+
+    python watch.py tas/
+    python watch.py --engine auto -o out/ --manifest out/manifest.json tas/
+
+The template is parsed and the engine set up once, when the watch starts.
+After that, saving a TA file (tas/*.txt) only fills and writes its own
+form again, in the same process, so the PDF is up to date a fraction of a
+second after the save. Saves are debounced: the forms are regenerated once
+no TA file has changed for DEBOUNCE seconds, so an editor writing a file
+several times (or a "git checkout" touching many) costs one regeneration
+per file. A save that does not change the file's contents is skipped.
+
+Errors in a TA file (see roster.parse_lines) are reported as soon as it is
+saved, with their line number, and its previous PDF is left alone until
+the file is fixed. When the watch starts, every form that is missing or
+out of date is generated first (up to date: newer than its TA file, or
+with --manifest, built from the same inputs; see manifest.py).
+
+Changes are picked up with Linux inotify. Where inotify is not available
+(or with --poll), the directory is scanned every POLL_INTERVAL seconds.
+Restart the watch after changing the template or the course fields.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from convert import APPROVER, DATE, INFO_FIELDS
+from engines import (PDF_ENGINES as ENGINES, choose_engine, format_report,
+                     get_engine)
+from field_map import template_hash
+from manifest import Manifest, build_key
+from naming import output_path
+from roster import RosterError, find_data_files, parse_data
+
+# Seconds without changes before the changed forms are regenerated
+DEBOUNCE = 0.2
+
+# Seconds between two scans of the directory when polling
+POLL_INTERVAL = 0.5
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Files written (or renamed into place, as many editors save) and removed
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE |
+              IN_DELETE_SELF)
+
+# struct inotify_event, without its name
+_EVENT = struct.Struct("iIII")
+
+
+def is_data_file(name):
+    """
+    Return whether the file name is a TA data file, like the ones
+    find_data_files picks from a directory.
+    """
+    return name.endswith(".txt") and not name.startswith(".")
+
+
+class InotifyWatcher(object):
+    """
+    Report the TA files of a directory that changed, with Linux inotify
+    (through ctypes, so no extra package is needed).
+    """
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("No C library to call inotify from")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("The C library has no inotify")
+        self.directory = directory
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        watch = libc.inotify_add_watch(self.fd,
+                                       os.fsencode(directory), WATCH_MASK)
+        if watch < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds (None: until something happens) and
+        return the set of TA file paths that changed. Returns None if
+        changes may have been missed, so that every file is checked.
+        """
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                watch, mask, cookie, length = _EVENT.unpack_from(data,
+                                                                 offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length]
+                                   .rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & (IN_DELETE_SELF | IN_IGNORED):
+                    raise OSError("{0} was removed".format(self.directory))
+                if is_data_file(name):
+                    changed.add(os.path.join(self.directory, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Report the TA files of a directory that changed, by comparing the
+    modification time and size of every file every interval seconds.
+    """
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.files = self.scan()
+
+    def scan(self):
+        files = {}
+        for entry in os.scandir(self.directory):
+            if is_data_file(entry.name):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds (None: until something happens) and
+        return the set of TA file paths that changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+            files = self.scan()
+            changed = set(path for path in set(files) | set(self.files)
+                          if files.get(path) != self.files.get(path))
+            self.files = files
+            if changed or (deadline is not None and
+                           time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory, poll=False):
+    """
+    Return an InotifyWatcher for directory, or a PollingWatcher if poll is
+    true or inotify is not available.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory)
+
+
+class Regenerator(object):
+    """
+    Fill and write the forms of changed TA files with an engine that stays
+    loaded between changes.
+    """
+
+    def __init__(self, outdir=None, engine="acroform", template="DDAH.pdf",
+                 manifest=None, report=print):
+        self.outdir = outdir
+        self.engine = get_engine(engine, template)
+        self.engine_name = engine
+        self.template_digest = template_hash(template)
+        self.manifest = Manifest(manifest) if manifest is not None else None
+        self.report = report
+        # The build key each PDF was last generated (or failed) from
+        self.keys = {}
+        # Parse the template now, not on the first save
+        self.engine.load()
+
+    def key(self, data_file):
+        return build_key(data_file, self.engine_name, self.template_digest,
+                         INFO_FIELDS, APPROVER, DATE)
+
+    def is_up_to_date(self, data_file, pdf_out_file, key):
+        if self.keys.get(pdf_out_file) == key:
+            return True
+        if self.manifest is not None:
+            return self.manifest.is_up_to_date(pdf_out_file, key)
+        if pdf_out_file in self.keys:
+            # Generated by this watch from other contents
+            return False
+        try:
+            return (os.path.getmtime(pdf_out_file) >=
+                    os.path.getmtime(data_file))
+        except OSError:
+            return False
+
+    def update(self, data_files):
+        """
+        Regenerate the forms of data_files that are out of date, reporting
+        each form written, each error and each TA file removed. Returns the
+        number of forms written.
+        """
+        if self.outdir is not None and not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        written = 0
+        for data_file in data_files:
+            pdf_out_file = output_path(data_file, self.outdir)
+            try:
+                key = self.key(data_file)
+            except FileNotFoundError:
+                if self.keys.pop(pdf_out_file, None) is not None:
+                    self.report("{0}: removed".format(data_file))
+                if self.manifest is not None:
+                    self.manifest.forget(pdf_out_file)
+                continue
+            except IOError as e:
+                self.report("{0}: {1}".format(data_file, e))
+                continue
+            if self.is_up_to_date(data_file, pdf_out_file, key):
+                continue
+
+            start = time.perf_counter()
+            self.keys[pdf_out_file] = key
+            try:
+                ta_data = parse_data(data_file)
+                self.engine.write(pdf_out_file, self.engine.fill(ta_data))
+            except RosterError as e:
+                self.report(str(e))
+                continue
+            except Exception as e:
+                self.report("{0}: {1}: {2}".format(data_file,
+                                                   type(e).__name__, e))
+                continue
+            written += 1
+            if self.manifest is not None:
+                self.manifest.record(pdf_out_file, data_file, key)
+            self.report("{0} -> {1} ({2:.0f} ms)".format(
+                data_file, pdf_out_file,
+                (time.perf_counter() - start) * 1000))
+        if self.manifest is not None:
+            self.manifest.save()
+        return written
+
+
+def watch(directory, outdir=None, engine="acroform", template="DDAH.pdf",
+          manifest=None, debounce=DEBOUNCE, poll=False, report=print):
+    """
+    Generate the out-of-date forms of the TA files in directory, then keep
+    regenerating each one as its file changes, until interrupted. See the
+    module docstring.
+    """
+    regenerator = Regenerator(outdir, engine, template, manifest, report)
+    watcher = open_watcher(directory, poll)
+    report("Watching {0} ({1}, {2} engine)".format(
+        directory, "inotify" if isinstance(watcher, InotifyWatcher)
+        else "polling", engine))
+    try:
+        regenerator.update(find_data_files([directory]))
+        pending = set()
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            changed = watcher.wait(timeout)
+            if changed is None:
+                # Missed events: look at every file
+                changed = set(find_data_files([directory])) | pending
+            if changed:
+                pending |= changed
+                deadline = time.monotonic() + debounce
+            elif deadline is not None and time.monotonic() >= deadline:
+                regenerator.update(sorted(pending))
+                pending = set()
+                deadline = None
+    finally:
+        watcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Regenerate DDAH forms as TA files change.")
+    parser.add_argument("directory", help="directory of TA data files")
+    parser.add_argument("-o", "--outdir",
+                        help="write PDFs here instead of next to each input")
+    parser.add_argument("--manifest", metavar="JSON",
+                        help="build manifest, to also skip unchanged TAs "
+                             "across restarts")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE,
+                        help="seconds without changes before regenerating "
+                             "(default: {0})".format(DEBOUNCE))
+    parser.add_argument("--poll", action="store_true",
+                        help="scan the directory instead of using inotify")
+    parser.add_argument("--engine", choices=sorted(ENGINES) + ["auto"],
+                        default="acroform",
+                        help="fill engine; auto picks the fastest correct "
+                             "one for the template (see engines.py)")
+    parser.add_argument("--template", default="DDAH.pdf")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        parser.error("{0} is not a directory".format(args.directory))
+
+    if args.engine == "auto":
+        try:
+            args.engine, report = choose_engine(args.template)
+        except ValueError as e:
+            parser.error(str(e))
+        for line in format_report(report, args.engine):
+            print(line)
+
+    def report(message):
+        print(message, flush=True)
+
+    try:
+        watch(args.directory, args.outdir, args.engine, args.template,
+              args.manifest, args.debounce, args.poll, report)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())